@@ -1,106 +1,68 @@
-from groq import Groq
 import streamlit as st
-from src.helper import download_hugging_face_embeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_groq import ChatGroq
-from langchain.chains import LLMChain
-from langchain.chains.conversation.memory import ConversationBufferMemory
-from langchain_core.prompts import ChatPromptTemplate
-from pymongo import MongoClient
+from src.chat import respond
+from src.context import SessionDocumentIndex
+from src.history import load_history, parse_session_id
+from src.tracing import span
+from src.resources import (
+    get_upload_embeddings, get_mongo_collection, get_history_writer, get_answer_cache,
+    get_session_memories, get_upload_extractor, start_warm_up, start_tracing, mark_once,
+)
 from dotenv import load_dotenv
+import logging
 import uuid
 import os
-from src.prompt import *
-from pinecone import Pinecone
-from PyPDF2 import PdfReader
 
 load_dotenv()
-
-# MongoDB configuration
-MONGO_URI = os.environ.get("MONGO_URI")
-client = MongoClient(MONGO_URI)
-db = client["medical_chatbot"]
-collection = db["chat_history"]
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] : %(message)s:')
 
 PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 
 os.environ["GROQ_API_KEY"] = GROQ_API_KEY
-os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
-
-embeddings = download_hugging_face_embeddings()
-
-index_name = "medical-chatbot"
-
-# Initialize Pinecone
-pinecone_instance = Pinecone(api_key=PINECONE_API_KEY)
-
-# Check and create index if it doesn't exist
-if index_name not in pinecone_instance.list_indexes().names():
-    pinecone_instance.create_index(
-        name=index_name,
-        dimension=384,  # Match your embedding dimension
-        metric='cosine'
-    )
-
-# Initialize the document searcher
-docsearch = PineconeVectorStore.from_existing_index(
-    index_name=index_name,
-    embedding=embeddings
-)
-
-retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-
-llm = ChatGroq(
-    model="gemma-7b-it",
-    temperature=1,
-    max_tokens=1024,
-    verbose=True,
-)
-
-# Define prompt with expected input variables 'context' and 'input'
-prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", system_prompt),
-        ("human", "{history}\nUser: {input}"),
-    ]
-)
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+if PINECONE_API_KEY:
+    os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
 
-# Initialize memory to store conversation context
-memory = ConversationBufferMemory(
-    memory_key="history",
-    input_key="input",
-    return_messages=True
-)
+# Models, vector store, LLM client and MongoDB client are built once per process on first
+# use (see src/resources.py) and shared across sessions and Streamlit reruns. With
+# WARM_UP enabled they are built in the background as soon as the server starts.
+if os.environ.get("WARM_UP", "false").lower() in ("1", "true", "yes"):
+    start_warm_up()
 
-# Create an LLM chain that includes memory
-conversation_chain = LLMChain(
-    llm=llm,
-    prompt=prompt,
-    memory=memory,
-    verbose=True
-)
+# Per-stage spans and latency histograms of each turn when TRACING is on, served on
+# METRICS_PORT (/metrics, /metrics.json) and/or appended to TRACE_FILE
+start_tracing()
 
 def get_session_id():
-    # Check if a session ID already exists; otherwise, create a new one.
+    # Check if a session ID already exists (in this session or in the URL); otherwise, create a new one.
+    # Only IDs in the form the app issues are resumed, so ?session=test cannot open stored chats
     if "session_id" not in st.session_state:
-        st.session_state["session_id"] = str(uuid.uuid4())  # Generate a unique session ID
+        st.session_state["session_id"] = parse_session_id(st.query_params.get("session")) or str(uuid.uuid4())  # Generate a unique session ID
+        st.query_params["session"] = st.session_state["session_id"]  # Keep it so a reload resumes the session
     return st.session_state["session_id"]
 
-def save_to_mongo(user_input, bot_response, session_id):
-    collection.insert_one({
-        "session_id": session_id,
-        "user_input": user_input,
-        "bot_response": bot_response
-    })
+def save_to_mongo(user_input, bot_response, session_id, metrics=None, turn=None):
+    with span("history.save", bytes=len(user_input.encode("utf-8")) + len(bot_response.encode("utf-8"))):
+        get_history_writer().save(session_id, user_input, bot_response, turn=turn, metrics=metrics)
 
-# Function to read and extract text from a PDF file
+# Start (or reuse) the background text extraction of an uploaded PDF; the result is
+# cached by content hash, so reruns and re-uploads of the same file cost nothing
 def extract_text_from_pdf(pdf_file):
-    reader = PdfReader(pdf_file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    return get_upload_extractor().extract(pdf_file.getvalue())
+
+# Chunk and embed the pages of the upload extracted since the last rerun; each turn only
+# searches the session's document index
+def update_document_index(name, extraction):
+    if st.session_state.get("document_key") != extraction.digest:
+        st.session_state["document_index"] = SessionDocumentIndex.from_text("", get_upload_embeddings(), name=name)
+        st.session_state["document_key"] = extraction.digest
+        st.session_state["document_pages"] = 0
+    indexed, ready = st.session_state["document_pages"], extraction.ready_pages
+    if ready > indexed:
+        st.session_state["document_index"].extend(extraction.text(indexed, ready), get_upload_embeddings())
+        st.session_state["document_pages"] = ready
+    # Identifies the upload and how much of it is indexed, for the answer cache
+    st.session_state["document_content"] = f"{extraction.digest}:{ready}"
 
 # Streamlit App
 def main():
@@ -120,16 +82,44 @@ def main():
 
     if uploaded_file is not None:
         if uploaded_file.type == "application/pdf":
-            # Extract text from the uploaded PDF
-            pdf_content = extract_text_from_pdf(uploaded_file)
-            st.success(f"File '{uploaded_file.name}' uploaded successfully.")
-            st.write("### Extracted PDF Content")
-            st.text_area("Content from PDF", pdf_content, height=200)
-            st.session_state["document_content"] = pdf_content
+            # Extract text from the uploaded PDF in the background, page by page
+            try:
+                extraction = extract_text_from_pdf(uploaded_file)
+            except ValueError as e:
+                st.error(str(e))
+                extraction = None
+            if extraction is not None:
+                # Wait briefly for the first page so there is something to show and search
+                extraction.wait(pages=1, timeout=5)
+                st.success(f"File '{uploaded_file.name}' uploaded successfully.")
+                if not extraction.done:
+                    st.info(f"{extraction.ready_pages} of {len(extraction.pages)} pages extracted so far. "
+                            "The chat uses them already; the rest is added as it is extracted.")
+                if extraction.truncated:
+                    st.warning(f"Only the first {len(extraction.pages)} of {extraction.page_count} pages are used.")
+                if extraction.error:
+                    st.warning(extraction.error)
+                st.write("### Extracted PDF Content")
+                st.text_area("Content from PDF", extraction.text(), height=200)
+                st.session_state["document_extraction"] = (uploaded_file.name, extraction)
+                update_document_index(uploaded_file.name, extraction)
+    else:
+        # The upload was removed
+        st.session_state.pop("document_extraction", None)
+        st.session_state.pop("document_index", None)
+        st.session_state.pop("document_key", None)
+        st.session_state["document_content"] = ""
 
     # Initialize session state for chat history and document content if they don't exist
     if "chat_history" not in st.session_state:
-        st.session_state["chat_history"] = []
+        # Rehydrate a resumed session from MongoDB (most recent page of turns)
+        session_id = get_session_id()
+        chat_history = load_history(get_mongo_collection(), session_id)
+        st.session_state["chat_history"] = chat_history
+        st.session_state["next_turn"] = (chat_history[-1].get("turn") or len(chat_history) - 1) + 1 if chat_history else 0
+        memory = get_session_memories().get(session_id)
+        if chat_history and not memory.turns:
+            memory.restore((chat["user_input"], chat["bot_response"]) for chat in chat_history)
     if "document_content" not in st.session_state:
         st.session_state["document_content"] = ""
 
@@ -153,31 +143,44 @@ def main():
         with chat_history_container:
             st.chat_message("user").write(f"{user_input}")
 
-        # Update memory with user input
-        memory.chat_memory.add_user_message(user_input)
-
-        # Use the stored document content as part of the context
-        context = st.session_state["document_content"] if st.session_state["document_content"] else ""
-
-        # Invoke conversation chain with user message, history, and persistent context
-        response = conversation_chain({"input": user_input, "context": context})
-        bot_response = response["text"]
+        # Get or create session ID
+        session_id = get_session_id()
 
-        # Update memory with bot response
-        memory.chat_memory.add_ai_message(bot_response)
+        # Pick up pages of the upload extracted since the page was rendered
+        if "document_extraction" in st.session_state:
+            update_document_index(*st.session_state["document_extraction"])
 
-        # Display bot response
+        # Answer from the cache, the datasets or the LLM (see src/chat.py) and render the
+        # tokens as they arrive; the full text is returned once the response is complete
+        metrics = {}
         with chat_history_container:
-            st.chat_message("assistant").write(f"{bot_response}")
+            bot_response = st.chat_message("assistant").write_stream(
+                respond(session_id, user_input, metrics, st.session_state["document_content"],
+                        st.session_state.get("document_index"), stream=STREAM_RESPONSES)
+            )
 
         # Save the conversation to session state
-        st.session_state["chat_history"].append({"user_input": user_input, "bot_response": bot_response})
-
-        # Get or create session ID
-        session_id = get_session_id()
+        st.session_state["chat_history"].append({"user_input": user_input, "bot_response": bot_response, "metrics": metrics})
 
         # Save conversation to MongoDB
-        save_to_mongo(user_input, bot_response, session_id)
+        metrics.pop("turn", None)
+        save_to_mongo(user_input, bot_response, session_id, metrics, st.session_state["next_turn"])
+        st.session_state["next_turn"] += 1
+        mark_once("first_response")
+
+        if "time_to_first_token" in metrics:
+            st.caption(f"First token after {metrics['time_to_first_token']}s"
+                       + (f", full response in {metrics['generation_time']}s" if "generation_time" in metrics else ""))
+
+    mark_once("first_render")
+
+    # Report how much the answer cache is saving
+    cache_stats = get_answer_cache().stats()
+    st.sidebar.caption(
+        f"Answer cache: {cache_stats['hit_rate']:.0%} hit rate "
+        f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}), "
+        f"{cache_stats['saved_seconds']}s of generation saved"
+    )
 
 if __name__ == "__main__":
     main()
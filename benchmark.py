@@ -0,0 +1,313 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+
+# Offline benchmark of the whole bot: ingestion, embedding, retrieval and chat turns run
+# against local stand-ins (a fake LLM, the local vector store and mongomock), so results
+# can be compared between commits on a machine without network access.
+#
+#   python benchmark.py --sessions 8 --turns 5 --output benchmark_results.json
+
+INDEX_NAME = "medical-chatbot"
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Questions asked by the simulated sessions, in English and Indonesian, including some
+# dataset lookups answered by src/structured.py
+QUESTIONS = [
+    "What are the symptoms of monkeypox?",
+    "Apa saja gejala monkeypox?",
+    "How is type 2 diabetes treated?",
+    "Bagaimana cara mencegah diabetes melitus?",
+    "What is the recommended dose of amoxicillin for adults?",
+    "Berapa kandungan protein tempe?",
+    "What causes high blood pressure?",
+    "Which antiviral medicines come as injections?",
+    "How many antibiotic tablets are there?",
+    "What should I do if I have a fever and a headache?",
+    "Apa penyebab anemia?",
+    "Is it safe to take paracetamol with ibuprofen?",
+]
+
+
+# count, mean and p50/p95/p99/max of latency samples (seconds), in milliseconds
+def latency_summary(samples):
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# "hash" needs nothing but numpy; "torch" and "onnx" load the real model (from the local
+# Hugging Face cache when offline)
+def make_embeddings(kind):
+    if kind in ("torch", "onnx"):
+        from src.embeddings import load_embeddings
+        return load_embeddings(MODEL_NAME, backend=kind)
+    from src.fakes import HashEmbeddings
+    return HashEmbeddings()
+
+
+# Ingest the files under data_dirs into a fresh local index, as store_index.py does
+def bench_ingestion(embeddings, data_dirs, dedup=True):
+    from src.vector_store import get_index
+    from src.lexical import get_lexical_index
+    from src.dedup import get_dedup_index
+    from src.pipeline import IngestionPipeline
+
+    file_paths = sorted(
+        path.replace(os.sep, "/")
+        for data in data_dirs
+        for pattern in ("*.pdf", "*.csv")
+        for path in glob.glob(os.path.join(data, pattern))
+    )
+    index = get_index(INDEX_NAME, embeddings=embeddings)
+    lexical = get_lexical_index(INDEX_NAME)
+    stats = IngestionPipeline(embeddings, index, lexical_index=lexical,
+                              dedup_index=get_dedup_index(INDEX_NAME) if dedup else None).run(file_paths)
+    began = time.perf_counter()
+    lexical.save()
+    stats["lexical_save_seconds"] = round(time.perf_counter() - began, 3)
+    stats["files"] = len(file_paths)
+    stats["chunks"] = len(lexical)
+    return stats, lexical.texts
+
+
+# Texts per second of embed_documents at each batch size
+def bench_embedding(embeddings, texts, batch_sizes, sample_size):
+    texts = (texts * (sample_size // max(len(texts), 1) + 1))[:sample_size]
+    results = {}
+    for batch_size in batch_sizes:
+        began = time.perf_counter()
+        for start in range(0, len(texts), batch_size):
+            embeddings.embed_documents(texts[start:start + batch_size])
+        elapsed = time.perf_counter() - began
+        results[str(batch_size)] = {"texts": len(texts), "seconds": round(elapsed, 3),
+                                    "texts_per_second": round(len(texts) / elapsed, 1) if elapsed else 0.0}
+    return results
+
+
+# Latency of the dense and hybrid retrievers, with and without MMR, over distinct queries
+# (so the query embedding cache does not hide the embedding cost), and how many of their
+# results nearly repeat another result of the same query
+def bench_retrieval(iterations):
+    from src.dedup import shingles, jaccard
+    from src.lexical import HybridRetriever
+    from src.resources import get_docsearch, get_lexical_index
+
+    mmr = {"k": 3, "fetch_k": 10, "lambda_mult": 0.7}
+    retrievers = {
+        "dense": get_docsearch().as_retriever(search_type="similarity", search_kwargs={"k": 3}),
+        "dense_mmr": get_docsearch().as_retriever(search_type="mmr", search_kwargs=mmr),
+    }
+    if len(get_lexical_index()):
+        retrievers["hybrid"] = HybridRetriever(vector_store=get_docsearch(), lexical_index=get_lexical_index(), k=3)
+        retrievers["hybrid_mmr"] = HybridRetriever(vector_store=get_docsearch(), lexical_index=get_lexical_index(),
+                                                   k=3, lambda_mult=mmr["lambda_mult"])
+
+    results = {}
+    for mode, retriever in retrievers.items():
+        samples, redundant, returned = [], 0, 0
+        for i in range(iterations):
+            query = f"{QUESTIONS[i % len(QUESTIONS)]} {mode} {i}"
+            began = time.perf_counter()
+            documents = retriever.invoke(query)
+            samples.append(time.perf_counter() - began)
+            texts = [shingles(doc.page_content) for doc in documents]
+            returned += len(texts)
+            redundant += sum(any(jaccard(texts[a], texts[b]) >= 0.5 for a in range(b)) for b in range(len(texts)))
+        results[mode] = latency_summary(samples)
+        results[mode]["near_duplicate_results"] = round(redundant / returned, 3) if returned else 0.0
+    return results
+
+
+# Full chat turns (answer cache, retrieval, LLM, memory, history write) from concurrent
+# simulated sessions, each asking its questions one after another like a user would
+def bench_chat(sessions, turns, stream):
+    from src.chat import respond
+    from src.resources import get_history_writer, get_answer_cache, get_mongo_collection
+
+    writer = get_history_writer()
+    latencies, first_tokens, errors = [], [], []
+    lock = threading.Lock()
+
+    def session(number):
+        session_id = f"benchmark-{number}"
+        for turn in range(turns):
+            question = QUESTIONS[(number + turn) % len(QUESTIONS)]
+            metrics = {}
+            began = time.perf_counter()
+            first_token, pieces = None, []
+            try:
+                for text in respond(session_id, question, metrics, stream=stream):
+                    if first_token is None:
+                        first_token = time.perf_counter() - began
+                    pieces.append(text)
+                writer.save(session_id, question, "".join(pieces), turn=turn, metrics=metrics)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - began)
+                first_tokens.append(first_token)
+
+    began = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(number,)) for number in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    writer.flush()
+
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "turn_latency": latency_summary(latencies),
+        "time_to_first_token": latency_summary(first_tokens),
+        "answer_cache": get_answer_cache().stats(),
+        "history_documents": get_mongo_collection().count_documents({}),
+        "errors": errors[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of ingestion, retrieval and chat turns")
+    parser.add_argument("--data-dirs", nargs="+", default=["Data/pdf"], help="directories to ingest")
+    parser.add_argument("--embeddings", choices=["hash", "torch", "onnx"], default="hash")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake LLM seconds before the first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--llm-response-tokens", type=int, default=120)
+    parser.add_argument("--llm-server", action="store_true",
+                        help="serve the fake LLM over HTTP and call it through ChatGroq, as the app calls Groq")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0,
+                        help="share of fake LLM server requests answered with a 429 or 503")
+    parser.add_argument("--llm-requests-per-minute", type=float, default=6000.0,
+                        help="rate limit of the LLM client pool (LLM_REQUESTS_PER_MINUTE)")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent simulated sessions")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--no-stream", action="store_true", help="use the non-streaming chain")
+    parser.add_argument("--retrieval-iterations", type=int, default=200)
+    parser.add_argument("--batch-sizes", default="1,8,32,64,128")
+    parser.add_argument("--embedding-sample", type=int, default=512, help="texts embedded per batch size")
+    parser.add_argument("--no-dedup", action="store_true", help="ingest without near-duplicate detection")
+    parser.add_argument("--trace", action="store_true", help="record per-stage latency histograms (or set TRACING)")
+    parser.add_argument("--workdir", help="where the benchmark index is built (default: a temporary directory)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="benchmark-")
+    # Everything the app would write goes to the work directory
+    os.environ["VECTOR_STORE"] = "local"
+    os.environ["LOCAL_INDEX_DIR"] = os.path.join(workdir, "vector_index")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite")
+    os.environ["LLM_REQUESTS_PER_MINUTE"] = str(args.llm_requests_per_minute)
+
+    import mongomock
+    from src import tracing
+    from src.fakes import FakeChatModel, FakeLLMServer
+    from src.llm_pool import pooled_model
+    from src.embedding_cache import CachedEmbeddings
+    from src.batching import BatchedEmbeddings
+    from src.resources import provide, warm_up, get_embeddings, get_llm, get_mongo_collection
+
+    tracing.configure(tracing=args.trace or None)
+    embeddings = make_embeddings(args.embeddings)
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": vars(args),
+    }
+
+    print("Ingesting", ", ".join(args.data_dirs))
+    results["ingestion"], texts = bench_ingestion(embeddings, args.data_dirs, dedup=not args.no_dedup)
+
+    print("Embedding batches")
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    results["embedding"] = bench_embedding(embeddings, texts, batch_sizes, args.embedding_sample)
+
+    # The app's resources, with the stand-ins in place of Groq, the model download and MongoDB
+    batched = BatchedEmbeddings(embeddings)
+    provide(get_embeddings, CachedEmbeddings(batched, MODEL_NAME))
+    # The LLM is always behind the client pool; with --llm-server the app's own get_llm
+    # builds it, talking to the fake server instead of Groq
+    llm_server = None
+    if args.llm_server:
+        llm_server = FakeLLMServer(latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second,
+                                   response_tokens=args.llm_response_tokens, failure_rate=args.llm_failure_rate)
+        os.environ["GROQ_API_BASE"] = llm_server.url
+        os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    else:
+        provide(get_llm, pooled_model(FakeChatModel(latency=args.llm_latency,
+                                                    tokens_per_second=args.llm_tokens_per_second,
+                                                    response_tokens=args.llm_response_tokens)))
+    provide(get_mongo_collection, mongomock.MongoClient()["medical_chatbot"]["chat_history"])
+
+    print("Retrieval")
+    results["retrieval"] = bench_retrieval(args.retrieval_iterations)
+
+    # Build every resource up front, as WARM_UP does, so chat turns are measured warm
+    results["warm_up"] = warm_up()
+
+    print(f"Chat turns: {args.sessions} sessions x {args.turns} turns")
+    results["chat"] = bench_chat(args.sessions, args.turns, stream=not args.no_stream)
+    results["chat"]["query_batching"] = batched.stats()
+    results["chat"]["llm_pool"] = get_llm().pool.stats()
+    if llm_server is not None:
+        results["chat"]["llm_server"] = dict(llm_server.counts)
+        llm_server.close()
+
+    if args.trace:
+        results["stages"] = tracing.snapshot()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    ingestion = results["ingestion"]
+    print(f"Ingestion: {ingestion['chunks']} chunks in {ingestion['seconds']}s")
+    if "dedup" in ingestion:
+        print(f"Near-duplicates dropped: {ingestion['dedup']['duplicates']} "
+              f"({ingestion['dedup']['index_shrink']:.1%}), ~{ingestion['dedup']['embedding_seconds_saved']}s of embedding saved")
+    for mode, summary in results["retrieval"].items():
+        print(f"Retrieval ({mode}): p50 {summary['p50_ms']}ms, p95 {summary['p95_ms']}ms, p99 {summary['p99_ms']}ms")
+    chat = results["chat"]
+    if chat["turn_latency"]["count"]:
+        print(f"Chat turn: p50 {chat['turn_latency']['p50_ms']}ms, p95 {chat['turn_latency']['p95_ms']}ms, "
+              f"{chat['turns_per_second']} turns/s")
+    pool = chat["llm_pool"]
+    print(f"LLM pool: {pool['requests']} requests, {pool['coalesced']} coalesced, {pool['retries']} retries, "
+          f"{pool['timeouts']} timeouts, {pool['fallbacks']} fallbacks, {pool['rate_limit_wait_seconds']}s rate-limited")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from benchmark import QUESTIONS, latency_summary
+from helper import load_pdf_file, text_split
+from src.embeddings import MODEL_NAME, OnnxEmbeddings, load_embeddings
+from src.vector_store import LocalVectorStore
+
+# Compare embedding backends and vector storage types on the Data/ corpus: document
+# throughput, query latency and model size of each backend (torch, the ONNX export in
+# full precision "onnx-fp32", and int8-quantized "onnx"), and recall@k, search latency
+# and vector memory of each (backend, storage dtype) pair against the current setup
+# (torch embeddings, float32 vectors, exact search).
+#
+#   python compare_embeddings.py --data Data/pdf --threads 4 --output embedding_comparison.json
+
+
+# The corpus chunks (an even sample of at most limit) and the queries to search with:
+# the benchmark questions plus the opening words of randomly chosen chunks
+def load_corpus(data_dir, limit, queries, seed=0):
+    texts = [chunk.page_content for chunk in text_split(load_pdf_file(data_dir)) if chunk.page_content.strip()]
+    rng = np.random.default_rng(seed)
+    if len(texts) > limit:
+        texts = [texts[i] for i in sorted(rng.choice(len(texts), limit, replace=False))]
+    openings = [" ".join(texts[i].split()[:12]) for i in rng.choice(len(texts), max(queries - len(QUESTIONS), 0))]
+    return texts, (QUESTIONS + openings)[:queries]
+
+
+# The embedding model of a backend name: those of load_embeddings plus "onnx-fp32"
+def make_embeddings(backend, threads):
+    if backend == "onnx-fp32":
+        return OnnxEmbeddings(MODEL_NAME, quantize=False, threads=threads)
+    return load_embeddings(MODEL_NAME, backend=backend, threads=threads)
+
+
+# Bytes of the model file an ONNX backend runs (None for torch)
+def model_bytes(embeddings):
+    if not isinstance(embeddings, OnnxEmbeddings):
+        return None
+    return os.path.getsize(os.path.join(embeddings.model_dir, "model_int8.onnx" if embeddings.quantize else "model.onnx"))
+
+
+def embed_corpus(backend, texts, queries, threads):
+    embeddings = make_embeddings(backend, threads)
+    embeddings.embed_documents(texts[:8])  # warm up
+
+    began = time.perf_counter()
+    documents = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    seconds = time.perf_counter() - began
+
+    samples, query_vectors = [], []
+    for query in queries:
+        began = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(query))
+        samples.append(time.perf_counter() - began)
+    stats = {"documents": len(texts), "seconds": round(seconds, 3),
+             "documents_per_second": round(len(texts) / seconds, 1), "query_latency": latency_summary(samples),
+             "model_bytes": model_bytes(embeddings)}
+    return documents, np.asarray(query_vectors, dtype=np.float32), stats
+
+
+# Top-k ids of every query from a local index of the vectors stored as dtype
+def search(workdir, name, texts, documents, query_vectors, dtype, k):
+    store = LocalVectorStore(name, None, index_dir=workdir, dimension=documents.shape[1], dtype=dtype)
+    store.add_embeddings(texts, documents, ids=[str(i) for i in range(len(texts))])
+    results, samples = [], []
+    for vector in query_vectors:
+        began = time.perf_counter()
+        results.append([doc.id for doc, _ in store.similarity_search_with_score_by_vector(vector, k)])
+        samples.append(time.perf_counter() - began)
+    # Size of the vectors search scans (the float32 file is only read for rescoring)
+    files = {"float32": ["vectors.f32"], "float16": ["vectors.f16"], "int8": ["vectors.i8", "scales.f32"]}[dtype]
+    memory = sum(os.path.getsize(os.path.join(store.index_dir, name)) for name in files)
+    return results, latency_summary(samples), memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends and vector storage types")
+    parser.add_argument("--data", default="Data/pdf")
+    parser.add_argument("--limit", type=int, default=5000, help="maximum number of chunks to embed")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", default="torch,onnx-fp32,onnx")
+    parser.add_argument("--dtypes", default="float32,float16,int8")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads per backend (EMBEDDING_THREADS)")
+    parser.add_argument("--output", default="embedding_comparison.json")
+    args = parser.parse_args()
+
+    texts, queries = load_corpus(args.data, args.limit, args.queries)
+    print(f"{len(texts)} chunks, {len(queries)} queries")
+
+    backends = args.backends.split(",")
+    results = {"chunks": len(texts), "queries": len(queries), "k": args.k, "backends": {}, "indexes": []}
+    vectors = {}
+    for backend in backends:
+        print(f"Embedding with {backend}")
+        documents, query_vectors, stats = embed_corpus(backend, texts, queries, args.threads)
+        vectors[backend] = (documents, query_vectors)
+        results["backends"][backend] = stats
+
+    # How close the other backends' vectors are to the reference backend's
+    reference_documents = vectors[backends[0]][0]
+    for backend in backends[1:]:
+        cosine = np.sum(vectors[backend][0] * reference_documents, axis=1)
+        results["backends"][backend]["mean_cosine_to_" + backends[0]] = round(float(cosine.mean()), 4)
+
+    with tempfile.TemporaryDirectory(prefix="compare-") as workdir:
+        reference = None
+        for backend in backends:
+            documents, query_vectors = vectors[backend]
+            for dtype in args.dtypes.split(","):
+                found, latency, memory = search(workdir, f"{backend}-{dtype}", texts, documents,
+                                                query_vectors, dtype, args.k)
+                # The first pair (torch, float32 by default) is the reference ranking
+                reference = reference or found
+                recall = np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, reference) if b])
+                results["indexes"].append({"backend": backend, "dtype": dtype, "recall_at_k": round(float(recall), 4),
+                                           "search_latency": latency, "vector_bytes": memory})
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for backend, stats in results["backends"].items():
+        size = f", model {stats['model_bytes'] / 1e6:.1f}MB" if stats["model_bytes"] else ""
+        print(f"{backend}: {stats['documents_per_second']} chunks/s, query p50 {stats['query_latency']['p50_ms']}ms{size}")
+    print(f"{'backend':9} {'dtype':8} {'recall@' + str(args.k):>9} {'search p50':>11} {'vectors':>10}")
+    for row in results["indexes"]:
+        print(f"{row['backend']:9} {row['dtype']:8} {row['recall_at_k']:9.3f} "
+              f"{row['search_latency']['p50_ms']:9.3f}ms {row['vector_bytes'] / 1e6:8.1f}MB")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
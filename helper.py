@@ -1,63 +1,54 @@
+import os
 from langchain.document_loaders import PyPDFLoader, DirectoryLoader, CSVLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceBgeEmbeddings
-import pdfplumber
+from src.embedding_cache import CachedEmbeddings
+from src.embeddings import load_embeddings, cache_name
+from src.vector_store import get_index
+from src.pipeline import IngestionPipeline
+from src.lexical import get_lexical_index
+from src.tracing import span, traced
 
 # Extract data from the PDF files
+@traced("ingest.load_pdf_file")
 def load_pdf_file(data):
     loader = DirectoryLoader(data, glob="*.pdf", loader_cls=PyPDFLoader)
     documents = loader.load()
     return documents
 
 # Extract data from the CSV files
+@traced("ingest.load_csv_file")
 def load_csv_file(data):
     loader = DirectoryLoader(data, glob="*.csv", loader_cls=lambda file_path: CSVLoader(file_path, encoding='utf-8'))
     documents = loader.load()
     return documents
 
 # Split the Data in Chunks
+@traced("ingest.text_split")
 def text_split(extracted_data):
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=20)
     text_chunks = text_splitter.split_documents(extracted_data)
     return text_chunks
 
-# Download the embeddings from Hugging Face
+# Download the embeddings from Hugging Face (torch or quantized ONNX, see EMBEDDING_BACKEND)
+@traced("ingest.load_embeddings")
 def download_hugging_face_embeddings():
-    embeddings = HuggingFaceBgeEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
-    return embeddings
+    model_name = 'sentence-transformers/all-MiniLM-L6-v2'
+    embeddings = load_embeddings(model_name)
+    return CachedEmbeddings(embeddings, cache_name(model_name))
 
 # Helper to extract and embed PDF content
 def embed_pdf_content(pdf_file_path, embeddings, index_name, pinecone_instance):
     try:
-        # Read PDF content
-        with pdfplumber.open(pdf_file_path) as pdf:
-            text = ""
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-
-        # Split text into chunks
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500, chunk_overlap=100
-        )
-        text_chunks = splitter.split_text(text)
-
-        # Create embeddings
-        embedding_model = embeddings
-        embeddings_result = embedding_model.embed_documents(text_chunks)
-
-        # Connect to Pinecone
-        index = pinecone_instance.Index(index_name)
-
-        # Save embeddings to Pinecone
-        docs_to_store = [{
-            'id': f"{pdf_file_path}-{i}",
-            'values': embeddings_result[i],
-            'metadata': {'text': text_chunks[i]}
-        } for i in range(len(text_chunks))]
-
-        index.upsert(vectors=docs_to_store)
+        with span("ingest.embed_pdf_content", bytes=os.path.getsize(pdf_file_path)) as s:
+            # Connect to Pinecone or the local vector store
+            index = get_index(index_name, pinecone_instance, embeddings)
+
+            # Parse pages in parallel, then embed and upsert the chunks in bounded batches
+            lexical = get_lexical_index(index_name)
+            pipeline = IngestionPipeline(embeddings, index, chunk_size=500, chunk_overlap=100, lexical_index=lexical)
+            stats = pipeline.run([pdf_file_path])
+            lexical.save()
+            s.set(chunks=stats["embed"]["chunks"])
         return "Embedding uploaded successfully."
 
     except Exception as e:
@@ -0,0 +1,142 @@
+from flask import Flask, Response, jsonify, render_template, request
+from flask_cors import CORS
+from src.chat import respond
+from src.history import load_history, parse_session_id
+from src.tracing import span
+from src.resources import (
+    get_mongo_collection, get_history_writer, get_session_memories, start_warm_up, start_tracing, mark_once, timings,
+)
+from dotenv import load_dotenv
+import logging
+import json
+import uuid
+import os
+
+# Headless chat API over the same pipeline as the Streamlit app (src/chat.py), with
+# templates/chat.html as its web client. Every request runs on its own thread and the
+# models, indexes and clients are shared (src/resources.py), so a session waiting on Groq
+# does not hold up the others, and queries embedded at the same time share model calls
+# (EMBEDDING_BATCHING).
+#
+#   python server.py                                    # development server on PORT (8080)
+#   gunicorn -k gthread --threads 32 -b :8080 server:app
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] : %(message)s:')
+
+app = Flask(__name__)
+CORS(app, resources={r"/api/*": {"origins": "*"}})
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+
+if os.environ.get("WARM_UP", "false").lower() in ("1", "true", "yes"):
+    start_warm_up()
+start_tracing()
+
+
+# Session from the request body or the session cookie, or a new one. Only IDs in the form
+# the server issues (random UUIDs) are accepted, so clients cannot pick short or shared names.
+def get_session_id(data=None):
+    for session_id in ((data or {}).get("session_id"), request.cookies.get("session_id")):
+        if parse_session_id(session_id):
+            return parse_session_id(session_id)
+    return str(uuid.uuid4())
+
+
+# The memory of a session, resumed from its MongoDB history if this process has not seen
+# the session yet; its turn count continues the numbering of the stored turns
+def restore_session(session_id):
+    memory = get_session_memories().get(session_id)
+    if not memory.turns and not memory.summary:
+        chat_history = load_history(get_mongo_collection(), session_id)
+        if chat_history:
+            last_turn = chat_history[-1].get("turn")
+            memory.restore(((chat["user_input"], chat["bot_response"]) for chat in chat_history),
+                           turn_count=last_turn + 1 if last_turn is not None else None)
+    return memory
+
+
+def save_to_mongo(user_input, bot_response, session_id, metrics=None, turn=None):
+    with span("history.save", bytes=len(user_input.encode("utf-8")) + len(bot_response.encode("utf-8"))):
+        get_history_writer().save(session_id, user_input, bot_response, turn=turn, metrics=metrics)
+    mark_once("first_response")
+
+
+# Answer a message in one piece
+def answer(session_id, user_input):
+    restore_session(session_id)
+    metrics = {}
+    bot_response = "".join(respond(session_id, user_input, metrics, stream=STREAM_RESPONSES))
+    save_to_mongo(user_input, bot_response, session_id, metrics, turn=metrics.pop("turn"))
+    return bot_response, metrics
+
+
+def with_session(response, session_id):
+    response.set_cookie("session_id", session_id, max_age=30 * 24 * 3600, samesite="Lax")
+    return response
+
+
+@app.route("/")
+def index():
+    return render_template("chat.html")
+
+
+# Form endpoint used by chat.html: field "msg", plain-text answer
+@app.route("/get", methods=["POST"])
+def chat_form():
+    user_input = request.form.get("msg", "").strip()
+    if not user_input:
+        return Response("Message is empty.", status=400, mimetype="text/plain")
+    session_id = get_session_id()
+    bot_response, _ = answer(session_id, user_input)
+    return with_session(Response(bot_response, mimetype="text/plain"), session_id)
+
+
+# JSON endpoint: {"message": ..., "session_id": optional} -> {"session_id", "response", "metrics"}
+@app.route("/api/chat", methods=["POST"])
+def chat_json():
+    data = request.get_json(silent=True) or {}
+    user_input = str(data.get("message", "")).strip()
+    if not user_input:
+        return jsonify(error="message is required"), 400
+    session_id = get_session_id(data)
+    bot_response, metrics = answer(session_id, user_input)
+    return with_session(jsonify(session_id=session_id, response=bot_response, metrics=metrics), session_id)
+
+
+# Streaming endpoint: same request as /api/chat, answered as server-sent events with one
+# {"text": ...} event per piece of the response and a final "done" event with the metrics
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    data = request.get_json(silent=True) or {}
+    user_input = str(data.get("message", "")).strip()
+    if not user_input:
+        return jsonify(error="message is required"), 400
+    session_id = get_session_id(data)
+
+    def events():
+        metrics, pieces = {}, []
+        try:
+            restore_session(session_id)
+            for text in respond(session_id, user_input, metrics, stream=True):
+                pieces.append(text)
+                yield f"data: {json.dumps({'text': text})}\n\n"
+        except Exception as e:
+            logging.exception("Chat turn failed")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        save_to_mongo(user_input, "".join(pieces), session_id, metrics, turn=metrics.pop("turn"))
+        yield f"event: done\ndata: {json.dumps({'session_id': session_id, 'metrics': metrics})}\n\n"
+
+    response = Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    return with_session(response, session_id)
+
+
+# Liveness plus the resource build timings (see src/resources.py)
+@app.route("/health")
+def health():
+    return jsonify(status="ok", timings=dict(timings))
+
+
+if __name__ == "__main__":
+    app.run(host=os.environ.get("HOST", "0.0.0.0"), port=int(os.environ.get("PORT", "8080")), threaded=True)
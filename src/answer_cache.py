@@ -0,0 +1,85 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    # Answers to earlier questions, looked up by meaning instead of exact wording: a new
+    # question reuses a stored answer when its embedding is close enough to a previous
+    # question asked against the same document context. Entries expire after a TTL and
+    # the least recently used ones are evicted once the cache is full.
+
+    def __init__(self, embeddings, threshold=None, ttl=None, max_entries=None):
+        self.embeddings = embeddings
+        self.threshold = threshold or float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.92"))
+        self.ttl = ttl or float(os.environ.get("ANSWER_CACHE_TTL", "86400"))
+        self.max_entries = max_entries or int(os.environ.get("ANSWER_CACHE_SIZE", "1000"))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def _context_key(context):
+        return hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+
+    def _embed(self, query):
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    # Return the cached answer for a question similar to query, or None
+    def lookup(self, query, context=""):
+        vector = self._embed(query)
+        context_key = self._context_key(context)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            keys = [key for key, entry in self._entries.items() if entry["context"] == context_key]
+            if keys:
+                scores = np.stack([self._entries[key]["vector"] for key in keys]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry = self._entries[keys[best]]
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    self.saved_seconds += entry["latency"]
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    # Remember the answer to query; latency is how long generating it took
+    def store(self, query, context, answer, latency=0.0):
+        vector = self._embed(query)
+        with self._lock:
+            key = (self._context_key(context), query)
+            self._entries[key] = {
+                "vector": vector,
+                "context": key[0],
+                "answer": answer,
+                "latency": latency,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 2),
+            }
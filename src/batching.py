@@ -0,0 +1,83 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+from src.tracing import span
+
+
+# Embed several queries with one model call. Models embed a query like a document with
+# their query instruction (if any) in front, so the batch goes through embed_documents.
+# Models that also prefix documents are embedded one query at a time.
+def embed_queries(embeddings, texts):
+    if getattr(embeddings, "embed_instruction", ""):
+        return [embeddings.embed_query(text) for text in texts]
+    instruction = getattr(embeddings, "query_instruction", "") or ""
+    return embeddings.embed_documents([instruction + text.replace("\n", " ") for text in texts])
+
+
+class BatchedEmbeddings(Embeddings):
+    # Wraps an embeddings model so queries embedded at the same time by concurrent
+    # requests share one model call. A background thread takes every query waiting in the
+    # queue (up to max_batch) and embeds them together; while one batch is embedded the
+    # next one builds up, so batches grow with load and a lone query is not held back.
+    # max_wait (EMBEDDING_BATCH_WAIT_MS) optionally keeps a batch open a little longer.
+    # Documents already come in batches and are embedded directly.
+
+    def __init__(self, embeddings, max_batch=None, max_wait=None):
+        self.embeddings = embeddings
+        self.max_batch = max_batch or int(os.environ.get("EMBEDDING_QUERY_BATCH", "64"))
+        self.max_wait = max_wait if max_wait is not None else float(os.environ.get("EMBEDDING_BATCH_WAIT_MS", "0")) / 1000
+        self.batches = 0
+        self.queries = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Identical questions asked at the same moment are embedded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                with span("embedding.query_batch", queries=len(batch), texts=len(texts)):
+                    vectors = dict(zip(texts, embed_queries(self.embeddings, texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self._lock:
+                self.batches += 1
+                self.queries += len(batch)
+            for text, future in batch:
+                future.set_result(vectors[text])
+
+    # Number of model calls, queries embedded and the mean batch size
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            }
@@ -0,0 +1,71 @@
+import time
+from src.streaming import stream_text
+from src.context import build_context, estimate_tokens
+from src.tracing import span
+from src.resources import (
+    get_embeddings, get_retriever, get_conversation_chain, get_streaming_chain,
+    get_answer_cache, get_session_memories, get_structured_engine,
+)
+
+
+# Answer one message of a session, yielding the response text as it is generated (a
+# single piece for cached or non-streamed answers). Once the response is complete the
+# turn is added to the session memory and the answer cache; metrics receives timings and
+# the number of the turn in the session ("turn").
+# The uploaded document (if any) identifies which cached answers are valid; only the
+# first message of a session uses the cache, since later ones depend on the conversation.
+# Each stage is traced as a span of the "chat.turn" trace (see src/tracing.py).
+def respond(session_id, user_input, metrics, document_content="", document_index=None, stream=True):
+    with span("chat.turn", input_tokens=estimate_tokens(user_input)) as turn:
+        with span("chat.memory") as s:
+            memory = get_session_memories().get(session_id)
+            history = memory.history()
+            s.set(tokens=estimate_tokens(history))
+        answer_cache = get_answer_cache()
+
+        # Reuse the answer to a similar earlier question about the same document if there is one
+        started = time.perf_counter()
+        bot_response = None
+        if not history:
+            with span("chat.answer_cache_lookup"):
+                bot_response = answer_cache.lookup(user_input, document_content)
+        if bot_response is not None:
+            metrics.update(cached=True, time_to_first_token=round(time.perf_counter() - started, 3))
+            yield bot_response
+        else:
+            # Only the passages of the upload and the knowledge index relevant to this
+            # question go into the prompt, trimmed to CONTEXT_TOKEN_BUDGET
+            # Lookups over the CSV datasets add the rows matching exact filters
+            with span("chat.structured_lookup") as s:
+                structured = get_structured_engine().lookup(user_input)
+                s.set(matched=structured is not None)
+            with span("chat.context") as s:
+                context = build_context(user_input, get_embeddings(), get_retriever(), document_index,
+                                        structured=structured)
+                s.set(tokens=estimate_tokens(context), bytes=len(context.encode("utf-8")))
+            inputs = {"input": user_input, "context": context, "history": history}
+
+            with span("llm.generate", prompt_tokens=sum(estimate_tokens(v) for v in inputs.values())) as s:
+                if stream:
+                    # Pass tokens on as they arrive
+                    pieces = []
+                    for text in stream_text(get_streaming_chain(), inputs, metrics):
+                        pieces.append(text)
+                        yield text
+                    bot_response = "".join(pieces)
+                    s.set(chunks=metrics["chunks"], time_to_first_token=metrics["time_to_first_token"])
+                else:
+                    # Invoke conversation chain with user message, history, and retrieved context
+                    bot_response = get_conversation_chain()(inputs)["text"]
+                    metrics["generation_time"] = round(time.perf_counter() - started, 3)
+                    yield bot_response
+                s.set(completion_tokens=estimate_tokens(bot_response))
+
+            if not history:
+                with span("chat.answer_cache_store"):
+                    answer_cache.store(user_input, document_content, bot_response, metrics["generation_time"])
+
+        # Update memory with the completed turn
+        with span("chat.memory_update"):
+            metrics["turn"] = memory.add_turn(user_input, bot_response)
+        turn.set(cached=bool(metrics.get("cached")), output_tokens=estimate_tokens(bot_response))
@@ -0,0 +1,94 @@
+import os
+import numpy as np
+from src.tracing import span
+
+
+# Rough token count (about four characters per token for English and Indonesian text)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class SessionDocumentIndex:
+    # Ephemeral in-memory index of one uploaded document: the text is chunked and
+    # embedded once when it is uploaded (or page by page as it is extracted, see extend()),
+    # and each turn only searches the vectors.
+
+    def __init__(self, chunks, vectors, name=""):
+        self.chunks = chunks
+        self.name = name
+        vectors = np.asarray(vectors, dtype=np.float32)
+        # A document without text (e.g. a scanned PDF) has no chunks and an empty index
+        vectors = vectors.reshape(len(chunks), -1) if chunks else np.empty((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.vectors = vectors / norms
+
+    @classmethod
+    def from_text(cls, text, embeddings, name="", chunk_size=500, chunk_overlap=50):
+        index = cls([], np.empty((0, 1)), name)
+        index.extend(text, embeddings, chunk_size, chunk_overlap)
+        return index
+
+    # Chunk, embed and add more text of the document (e.g. pages extracted since the last call)
+    def extend(self, text, embeddings, chunk_size=500, chunk_overlap=50):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        chunks = splitter.split_text(text)
+        if not chunks:
+            return
+        added = SessionDocumentIndex(chunks, embeddings.embed_documents(chunks))
+        self.vectors = np.concatenate([self.vectors, added.vectors]) if self.chunks else added.vectors
+        self.chunks = self.chunks + chunks
+
+    # The k chunks most similar to the query vector, best first
+    def search(self, query_vector, k=4):
+        if not self.chunks:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = self.vectors @ (query / (np.linalg.norm(query) or 1.0))
+        top = np.argsort(-scores)[:k]
+        return [self.chunks[i] for i in top]
+
+
+# Build the prompt context for one turn: the top chunks of the uploaded document (if
+# any) followed by the top chunks from the global knowledge index, de-duplicated and
+# trimmed to a fixed token budget so the prompt size does not grow with the upload.
+# A structured dataset lookup result, if there is one, comes before the knowledge index
+# passages.
+def build_context(query, embeddings, retriever, document_index=None, upload_k=None, token_budget=None,
+                  structured=None):
+    upload_k = upload_k or int(os.environ.get("UPLOAD_RETRIEVAL_K", "4"))
+    token_budget = token_budget or int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500"))
+
+    passages = []
+    if document_index is not None and document_index.chunks:
+        label = f"Uploaded PDF ({document_index.name})" if document_index.name else "Uploaded PDF"
+        with span("retrieval.upload"):
+            passages.extend((label, chunk) for chunk in document_index.search(embeddings.embed_query(query), upload_k))
+    if structured:
+        passages.append(("Dataset lookup", structured))
+    if retriever is not None:
+        with span("retrieval.search") as s:
+            documents = retriever.invoke(query)
+            s.set(results=len(documents))
+        for doc in documents:
+            source = os.path.basename(str(doc.metadata.get("source", ""))) or "Knowledge base"
+            passages.append((source, doc.page_content))
+
+    seen, parts, used = set(), [], 0
+    for source, text in passages:
+        text = text.strip()
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        part = f"[{source}]\n{text}"
+        tokens = estimate_tokens(part)
+        if used + tokens > token_budget:
+            remaining = (token_budget - used) * 4
+            # Keep a truncated passage only if a useful amount of it still fits
+            if remaining >= 200:
+                parts.append(part[:remaining])
+            break
+        parts.append(part)
+        used += tokens
+    return "\n\n".join(parts)
@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import zlib
+import threading
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+_PRIME = (1 << 61) - 1
+
+
+# Word 3-grams of a text as tuples, lowercased (a text of three words or fewer is one shingle)
+def shingles(text, size=3):
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return set(zip(*(words[i:] for i in range(size))))
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+# Maximal marginal relevance: positions of k candidates, each chosen for its relevance
+# minus its greatest similarity to the candidates already chosen (lambda_mult=1 is plain
+# top-k). similarity(j) gives the similarities of every candidate to candidate j; it is
+# only called for the chosen ones.
+def mmr(relevance, similarity, k, lambda_mult=0.7):
+    relevance = np.asarray(relevance, dtype=np.float64)
+    if not len(relevance):
+        return []
+    selected = [int(np.argmax(relevance))]
+    redundancy = np.asarray(similarity(selected[0]), dtype=np.float64)
+    while len(selected) < min(k, len(relevance)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+        if len(selected) < k:
+            redundancy = np.maximum(redundancy, similarity(selected[-1]))
+    return selected
+
+
+class MinHasher:
+    # num_perm min-hashes of a text's word 3-grams. Words are hashed with CRC32 and the
+    # 3-gram hashes are combined from them with numpy, so no shingle strings are built.
+    # The hash functions are seeded, so signatures from different runs can be compared.
+
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.mix = rng.integers(1, 1 << 32, 3, dtype=np.uint64)
+
+    # Signature as num_perm uint32 values, or None for a text without words
+    def signature(self, text):
+        words = np.array([zlib.crc32(word.encode("utf-8")) for word in _WORD.findall(text.lower())], dtype=np.uint64)
+        if not len(words):
+            return None
+        if len(words) < 3:
+            words = np.concatenate([words, np.zeros(3 - len(words), dtype=np.uint64)])
+        grams = (words[:-2] * self.mix[0] + words[1:-1] * self.mix[1] + words[2:] * self.mix[2]) & 0xFFFFFFFF
+        grams = np.unique(grams)
+        return ((np.outer(grams, self.a) + self.b) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+# Near-duplicate index of an ingested vector index, stored next to it (see LOCAL_INDEX_DIR)
+def get_dedup_index(index_name):
+    return NearDuplicateIndex(os.path.join(os.environ.get("LOCAL_INDEX_DIR", "vector_index"), index_name, "dedup"))
+
+
+class NearDuplicateIndex:
+    # MinHash signatures of the chunks kept in an index, bucketed by LSH bands so a new
+    # chunk is only compared with chunks that share a band with it. A chunk whose
+    # estimated Jaccard similarity to a kept chunk reaches threshold (DEDUP_THRESHOLD) is
+    # recorded as an alias of that chunk instead of being embedded. Aliases whose kept
+    # chunk is deleted are handed back by delete() so they can be indexed again.
+    # A bucket stops growing at max_bucket chunks: a band value shared by that many
+    # chunks (rows of one CSV, say) tells little, and a true near-duplicate shares
+    # several other bands with its original anyway. This keeps each check to at most
+    # bands * max_bucket signature comparisons, done in one vectorized step.
+
+    def __init__(self, path, threshold=None, num_perm=128, bands=16, max_bucket=32):
+        self.path = path
+        self.threshold = threshold or float(os.environ.get("DEDUP_THRESHOLD", "0.9"))
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_bucket = max_bucket
+        self.hasher = MinHasher(num_perm)
+        self._band_mix = np.random.default_rng(2).integers(1, 1 << 63, self.rows, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        with self._lock:
+            self.ids, self.aliases = [], {}
+            self.signatures = np.empty((1024, self.num_perm), dtype=np.uint32)
+            self._rows = {}
+            self._buckets = [{} for _ in range(self.bands)]
+            if os.path.exists(self._file("ids.json")):
+                with open(self._file("ids.json"), encoding="utf-8") as f:
+                    data = json.load(f)
+                self.aliases = data["aliases"]
+                for doc_id, signature in zip(data["ids"], np.load(self._file("signatures.npy"))):
+                    self._insert(doc_id, signature)
+
+    def __len__(self):
+        return len(self._rows)
+
+    # One 64-bit hash per band of the signature
+    def _band_keys(self, signature):
+        return (signature.reshape(self.bands, self.rows).astype(np.uint64) * self._band_mix).sum(axis=1).tolist()
+
+    def _insert(self, doc_id, signature):
+        row = len(self.ids)
+        if row == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.empty_like(self.signatures)])
+        self.signatures[row] = signature
+        self.ids.append(doc_id)
+        self._rows[doc_id] = row
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].setdefault(key, [])
+            if len(bucket) < self.max_bucket:
+                bucket.append(row)
+
+    # The kept chunk that doc_id nearly duplicates, or None if doc_id is kept itself
+    def duplicate_of(self, doc_id):
+        return self.aliases.get(doc_id)
+
+    # Compare a chunk with the kept chunks: returns the ID of the chunk it nearly
+    # duplicates (recording it as an alias), or None after adding it as a kept chunk
+    def check(self, doc_id, text):
+        signature = self.hasher.signature(text)
+        with self._lock:
+            if doc_id in self._rows or signature is None:
+                return None
+            if doc_id in self.aliases:
+                return self.aliases[doc_id]
+            candidates = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates.update(self._buckets[band].get(key, ()))
+            candidates = np.array([row for row in candidates if self.ids[row] is not None], dtype=np.int64)
+            if len(candidates):
+                # Estimated Jaccard similarity: the share of equal min-hashes
+                scores = (self.signatures[candidates] == signature).mean(axis=1)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    kept = self.ids[candidates[best]]
+                    self.aliases[doc_id] = kept
+                    return kept
+            self._insert(doc_id, signature)
+            return None
+
+    # Forget chunks (kept or aliases); returns the aliases of deleted kept chunks, which
+    # are forgotten too and have to be indexed again
+    def delete(self, ids):
+        ids = set(ids)
+        with self._lock:
+            for doc_id in ids:
+                row = self._rows.pop(doc_id, None)
+                if row is not None:
+                    self.ids[row] = None
+                self.aliases.pop(doc_id, None)
+            orphans = {alias for alias, kept in self.aliases.items() if kept in ids}
+            for alias in orphans:
+                del self.aliases[alias]
+            return orphans
+
+    # Forget every chunk and remove the files
+    def clear(self):
+        with self._lock:
+            for name in ("ids.json", "signatures.npy"):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+        self._load()
+
+    # Write the kept chunks and aliases to the files. The index in memory stays as it is
+    # (deleted rows are only left out of the files), so checks may run during a save.
+    def save(self):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            rows = [row for row, doc_id in enumerate(self.ids) if doc_id is not None]
+            signatures = self.signatures[rows]
+            with open(self._file("signatures.npy.tmp"), "wb") as f:
+                np.save(f, signatures)
+            os.replace(self._file("signatures.npy.tmp"), self._file("signatures.npy"))
+            with open(self._file("ids.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump({"ids": [self.ids[row] for row in rows], "aliases": self.aliases}, f)
+            os.replace(self._file("ids.json.tmp"), self._file("ids.json"))
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.tracing import span
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps an embeddings model so text that was embedded before is never embedded again.
+    # Document vectors are kept in a SQLite file keyed by a hash of the model name and the
+    # text, so they survive re-ingestion runs; query vectors (which the model may embed
+    # differently, e.g. with a query instruction) live in a bounded in-memory LRU.
+
+    def __init__(self, embeddings, model_name, path=None, query_cache_size=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path or os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite")
+        self.query_cache_size = query_cache_size or int(os.environ.get("EMBEDDING_QUERY_CACHE_SIZE", "1024"))
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {"documents": 0, "queries": 0}
+        self.misses = {"documents": 0, "queries": 0}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys, batch_size=500):
+        found = {}
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            found = self._lookup(list(set(keys)))
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            with span("embedding.documents", texts=len(missing),
+                      bytes=sum(len(text.encode("utf-8")) for text in missing.values())):
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            rows = [(key, np.asarray(vector, dtype=np.float32).tobytes())
+                    for key, vector in zip(missing, vectors)]
+            with self._lock:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self._db.commit()
+            found.update((key, list(vector)) for key, vector in zip(missing, vectors))
+
+        with self._lock:
+            self.hits["documents"] += len(texts) - len(missing)
+            self.misses["documents"] += len(missing)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key(text)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.hits["queries"] += 1
+                return vector
+            self.misses["queries"] += 1
+
+        with span("embedding.query", bytes=len(text.encode("utf-8"))):
+            vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._queries[key] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+    # Hit/miss counters and hit rates for documents and queries
+    def stats(self):
+        with self._lock:
+            report = {}
+            for kind in ("documents", "queries"):
+                total = self.hits[kind] + self.misses[kind]
+                report[kind] = {
+                    "hits": self.hits[kind],
+                    "misses": self.misses[kind],
+                    "hit_rate": round(self.hits[kind] / total, 3) if total else 0.0,
+                }
+            return report
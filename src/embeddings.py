@@ -0,0 +1,127 @@
+import os
+import importlib.util
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Query prefix HuggingFaceBgeEmbeddings adds, so both backends embed queries the same way
+QUERY_INSTRUCTION = "Represent this question for searching relevant passages: "
+
+
+class OnnxEmbeddings(Embeddings):
+    # The same sentence-transformers model exported to ONNX and dynamically quantized to
+    # int8, run on the CPU with ONNX Runtime (mean pooling and normalization as in
+    # sentence-transformers). Texts are sorted by length and batched up to a token budget,
+    # so batches are as large as possible with little padding. The export and quantization
+    # run once and are kept under EMBEDDING_ONNX_DIR.
+
+    def __init__(self, model_name=MODEL_NAME, model_dir=None, quantize=True, threads=None,
+                 max_batch_tokens=None, max_length=256, query_instruction=QUERY_INSTRUCTION):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.model_dir = model_dir or os.path.join(os.environ.get("EMBEDDING_ONNX_DIR", "onnx_models"),
+                                                   model_name.split("/")[-1])
+        self.quantize = quantize
+        self.max_batch_tokens = max_batch_tokens or int(os.environ.get("EMBEDDING_BATCH_TOKENS", "8192"))
+        self.query_instruction = query_instruction
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads or 0
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(self._prepare(), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.no_padding()
+
+    # Path of the model to run, exporting and quantizing it first if needed
+    def _prepare(self):
+        model_path = os.path.join(self.model_dir, "model.onnx")
+        if not os.path.exists(model_path):
+            try:
+                from optimum.exporters.onnx import main_export
+            except ImportError as e:
+                raise ImportError(f"Exporting {self.model_name} to ONNX needs Optimum: "
+                                  "pip install -r requirements-onnx.txt") from e
+            main_export(self.model_name, output=self.model_dir, task="feature-extraction")
+        if not self.quantize:
+            return model_path
+        quantized_path = os.path.join(self.model_dir, "model_int8.onnx")
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        return quantized_path
+
+    # Batches of text positions, shortest texts first, each at most max_batch_tokens padded tokens
+    def _batches(self, encodings):
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        batch = []
+        for i in order:
+            if batch and (len(batch) + 1) * len(encodings[i].ids) > self.max_batch_tokens:
+                yield batch
+                batch = []
+            batch.append(i)
+        if batch:
+            yield batch
+
+    def _embed(self, texts):
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(texts)
+        vectors = [None] * len(texts)
+        for batch in self._batches(encodings):
+            length = max(len(encodings[i].ids) for i in batch)
+            input_ids = np.zeros((len(batch), length), dtype=np.int64)
+            attention_mask = np.zeros((len(batch), length), dtype=np.int64)
+            for row, i in enumerate(batch):
+                ids = encodings[i].ids
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+            hidden = self.session.run(None, feeds)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            for row, i in enumerate(batch):
+                vectors[i] = pooled[row].tolist()
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts))
+
+    def embed_query(self, text):
+        return self._embed([self.query_instruction + text])[0]
+
+
+# The embedding model for EMBEDDING_BACKEND: "torch" (sentence-transformers in full
+# precision, the default) or "onnx" (int8-quantized ONNX Runtime). EMBEDDING_THREADS caps
+# the CPU threads either backend uses.
+def load_embeddings(model_name=MODEL_NAME, backend=None, threads=None):
+    backend = (backend or os.environ.get("EMBEDDING_BACKEND", "torch")).lower()
+    threads = threads or int(os.environ.get("EMBEDDING_THREADS", "0")) or None
+    if backend == "onnx":
+        if importlib.util.find_spec("onnxruntime") is None:
+            raise ImportError("EMBEDDING_BACKEND=onnx needs ONNX Runtime: pip install -r requirements-onnx.txt")
+        return OnnxEmbeddings(model_name, threads=threads)
+    if backend != "torch":
+        raise ValueError(f"Unsupported EMBEDDING_BACKEND: {backend}")
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    from langchain.embeddings import HuggingFaceBgeEmbeddings
+    return HuggingFaceBgeEmbeddings(model_name=model_name)
+
+
+# Name the embedding cache stores a backend's vectors under (quantized vectors differ
+# slightly from full precision ones, so they are cached separately)
+def cache_name(model_name=MODEL_NAME, backend=None):
+    backend = (backend or os.environ.get("EMBEDDING_BACKEND", "torch")).lower()
+    return model_name if backend == "torch" else f"{model_name}#{backend}-int8"
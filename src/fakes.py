@@ -0,0 +1,182 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from src.lexical import tokenize
+
+
+class FakeChatModel(BaseChatModel):
+    # Offline stand-in for ChatGroq: waits `latency` seconds before the first token, then
+    # produces response_tokens tokens at tokens_per_second (echoing words of the prompt)
+
+    latency: float = 0.3
+    tokens_per_second: float = 50.0
+    response_tokens: int = 120
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        words = str(messages[-1].content).split() if messages else []
+        words = words or ["ok"]
+        return [words[i % len(words)] for i in range(self.response_tokens)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + len(tokens) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for i, token in enumerate(self._tokens(messages)):
+            time.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=(" " if i else "") + token))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class HashEmbeddings(Embeddings):
+    # Offline stand-in for the MiniLM model: each word is hashed to a signed dimension, so
+    # texts sharing words get similar vectors and retrieval still behaves like retrieval
+
+    def __init__(self, dimension=384):
+        self.dimension = dimension
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in tokenize(text):
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class FakeLLMServer:
+    # Local stand-in for the Groq API (OpenAI-compatible POST .../chat/completions, plain
+    # or streamed as server-sent events) for testing the LLM client pool over HTTP. Answers
+    # like FakeChatModel; failure_rate of the requests get a 429 (with Retry-After) or a
+    # 503, and hang_rate of them stall for hang_seconds before answering. Point ChatGroq at
+    # it with GROQ_API_BASE=server.url.
+
+    def __init__(self, latency=0.3, tokens_per_second=50.0, response_tokens=120, failure_rate=0.0,
+                 hang_rate=0.0, hang_seconds=60.0, seed=0, port=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.counts = {"requests": 0, "failures": 0, "hangs": 0, "completions": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name="fake-llm-server", daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # What to do with the next request: "fail", "hang" or "answer"
+    def _outcome(self):
+        with self._lock:
+            self.counts["requests"] += 1
+            draw = self._random.random()
+            outcome = "fail" if draw < self.failure_rate else (
+                "hang" if draw < self.failure_rate + self.hang_rate else "answer")
+            self.counts[{"fail": "failures", "hang": "hangs", "answer": "completions"}[outcome]] += 1
+            return outcome
+
+    def _tokens(self, messages):
+        words = str(messages[-1].get("content", "")).split() if messages else []
+        words = words or ["ok"]
+        return [words[i % len(words)] for i in range(self.response_tokens)]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._json(404, {"error": {"message": "not found"}})
+                    return
+                outcome = server._outcome()
+                if outcome == "fail":
+                    if server._random.random() < 0.5:
+                        self._json(429, {"error": {"message": "rate limit reached", "type": "rate_limit"}},
+                                   {"Retry-After": "0.05"})
+                    else:
+                        self._json(503, {"error": {"message": "service unavailable"}})
+                    return
+                if outcome == "hang":
+                    time.sleep(server.hang_seconds)
+                time.sleep(server.latency)
+                tokens = server._tokens(body.get("messages", []))
+                model = body.get("model", "fake")
+                usage = {"prompt_tokens": sum(len(str(m.get("content", "")).split()) for m in body.get("messages", [])),
+                         "completion_tokens": len(tokens)}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                if body.get("stream"):
+                    self._stream(model, tokens, usage)
+                else:
+                    time.sleep(len(tokens) / server.tokens_per_second)
+                    self._json(200, {
+                        "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(tokens)},
+                                     "finish_reason": "stop", "logprobs": None}],
+                        "usage": usage,
+                    })
+
+            def _json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, model, tokens, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                base = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+                for i, token in enumerate(tokens):
+                    time.sleep(1 / server.tokens_per_second)
+                    delta = {"role": "assistant", "content": (" " if i else "") + token}
+                    self._event({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                self._event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                             "x_groq": {"usage": usage}})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _event(self, payload):
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
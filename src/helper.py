@@ -1,6 +1,8 @@
 from langchain.document_loaders import PyPDFLoader, DirectoryLoader, CSVLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceBgeEmbeddings
+from src.embedding_cache import CachedEmbeddings
+from src.embeddings import load_embeddings, cache_name
+from src.batching import BatchedEmbeddings
 import pandas as pd
 
 # Extract data from the PDF files
@@ -25,7 +27,11 @@ def text_split(extracted_data):
     text_chunks = text_splitter.split_documents(extracted_data)
     return text_chunks
 
-# Download the embeddings from Hugging Face
-def download_hugging_face_embeddings():
-    embeddings = HuggingFaceBgeEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
-    return embeddings
\ No newline at end of file
+# Download the embeddings from Hugging Face (torch or quantized ONNX, see EMBEDDING_BACKEND);
+# with batch_queries, queries embedded concurrently share model calls
+def download_hugging_face_embeddings(batch_queries=False):
+    model_name = 'sentence-transformers/all-MiniLM-L6-v2'
+    embeddings = load_embeddings(model_name)
+    if batch_queries:
+        embeddings = BatchedEmbeddings(embeddings)
+    return CachedEmbeddings(embeddings, cache_name(model_name))
\ No newline at end of file
@@ -0,0 +1,123 @@
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_FLUSH = object()
+
+
+# A client-supplied session ID in canonical form if it has the form the app issues (a random
+# UUID), or None; any other value must start a new session instead of opening a stored one
+def parse_session_id(value):
+    try:
+        parsed = uuid.UUID(str(value))
+    except ValueError:
+        return None
+    return str(parsed) if parsed.version == 4 else None
+
+
+# Index used by the writer and the paged history loader
+def ensure_indexes(collection):
+    collection.create_index([("session_id", 1), ("timestamp", -1)])
+
+
+class ChatHistoryWriter:
+    # Writes chat turns to MongoDB off the request path: turns are queued and a background
+    # thread flushes them with insert_many once batch_size turns are waiting or
+    # flush_interval seconds have passed. The queue is bounded, so if MongoDB falls behind
+    # save() blocks instead of letting memory grow; close() flushes what is left.
+
+    def __init__(self, collection, batch_size=50, flush_interval=1.0, max_queue=10000, retries=3):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = threading.Event()
+        ensure_indexes(collection)
+        self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def save(self, session_id, user_input, bot_response, turn=None, metrics=None):
+        record = {
+            "session_id": session_id,
+            "turn": turn,
+            "timestamp": datetime.now(timezone.utc),
+            "user_input": user_input,
+            "bot_response": bot_response,
+        }
+        if metrics:
+            record["metrics"] = metrics
+        self._queue.put(record)
+
+    # Block until everything queued so far has been written
+    def flush(self):
+        if self._closed.is_set():
+            return
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        done.wait()
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        # Wake the thread instead of letting it wait out flush_interval
+        self._queue.put((_FLUSH, threading.Event()))
+        self._thread.join()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple) and item[0] is _FLUSH:
+                self._write(batch)
+                batch = []
+                item[1].set()
+            elif item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+            if self._closed.is_set() and self._queue.empty():
+                self._write(batch)
+                return
+
+    def _write(self, batch):
+        if not batch:
+            return
+        for attempt in range(1, self.retries + 1):
+            try:
+                with span("history.insert_many", documents=len(batch)):
+                    self.collection.insert_many(batch, ordered=False)
+                return
+            except Exception:
+                if attempt == self.retries:
+                    logger.exception("Dropping %d chat turns after %d failed writes", len(batch), attempt)
+                    return
+                time.sleep(0.5 * 2 ** attempt)
+
+
+# Load one page of a session's turns, oldest first. Page 0 is the most recent page_size
+# turns, page 1 the ones before them, and so on.
+def load_history(collection, session_id, page=0, page_size=20):
+    cursor = (collection.find({"session_id": session_id}, {"_id": 0})
+              .sort([("timestamp", -1), ("turn", -1)])
+              .skip(page * page_size)
+              .limit(page_size))
+    return list(reversed(list(cursor)))
@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import math
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from src.tracing import span
+from src.dedup import shingles, jaccard, mmr
+
+_TOKEN = re.compile(r"\w+")
+
+# Very common English and Indonesian words that carry no meaning for retrieval
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were what which with
+ada adalah akan atau bagaimana dan dari dengan di dalam ini itu juga ke karena oleh pada saya untuk yang
+""".split())
+
+
+def tokenize(text):
+    return [t for t in _TOKEN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+# Lexical index of an ingested vector index, stored next to it (see LOCAL_INDEX_DIR)
+def get_lexical_index(index_name):
+    return LexicalIndex(os.path.join(os.environ.get("LOCAL_INDEX_DIR", "vector_index"), index_name, "lexical"))
+
+
+class LexicalIndex:
+    # BM25 inverted index. On disk the posting lists are stored in CSR form: one array of
+    # document numbers (uint32) and one of term frequencies (uint16) for all terms, with
+    # per-term offsets, memory-mapped on load. Documents added after loading go into small
+    # in-memory posting lists and deletions are tombstones, until save() rewrites the files.
+    # search() picks up files rewritten by another process (store_index.py) via refresh().
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._refreshing = threading.Lock()
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    # Identifies one version of the files: terms.json is the last file save() replaces
+    def _version(self):
+        try:
+            stat = os.stat(self._file("terms.json"))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+    # The state of an index freshly loaded from the files
+    def _read(self):
+        version = self._version()
+        ids, texts, metadatas = [], [], []
+        terms = {}
+        offsets = np.zeros(1, dtype=np.int64)
+        postings = np.empty(0, dtype=np.uint32)
+        tfs = np.empty(0, dtype=np.uint16)
+        lengths = np.empty(0, dtype=np.uint32)
+        if version is not None:
+            with open(self._file("docs.jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    ids.append(record["id"])
+                    texts.append(record["text"])
+                    metadatas.append(record["metadata"])
+            with open(self._file("terms.json"), encoding="utf-8") as f:
+                terms = {term: i for i, term in enumerate(json.load(f))}
+            offsets = np.load(self._file("offsets.npy"), mmap_mode="r")
+            postings = np.load(self._file("postings.npy"), mmap_mode="r")
+            tfs = np.load(self._file("tfs.npy"), mmap_mode="r")
+            lengths = np.load(self._file("lengths.npy"))
+        return {
+            "_loaded_version": version, "ids": ids, "texts": texts, "metadatas": metadatas,
+            "_terms": terms, "_offsets": offsets, "_postings": postings, "_tfs": tfs, "_lengths": lengths,
+            "_id_to_doc": {doc_id: doc for doc, doc_id in enumerate(ids)},
+            "_deleted": set(), "_pending": {}, "_total_length": int(lengths.sum()),
+        }
+
+    def _load(self):
+        with self._lock:
+            self.__dict__.update(self._read())
+
+    # Reload the files if they were rewritten since they were loaded; returns whether they
+    # were. An index with unsaved changes of its own is left as it is, and a load that
+    # overlapped another rewrite is discarded (the next call tries again). Searches keep
+    # using the loaded state while the new one is read.
+    def refresh(self):
+        version = self._version()
+        if version == self._loaded_version or self._pending or self._deleted:
+            return False
+        if not self._refreshing.acquire(blocking=False):
+            return False
+        try:
+            state = self._read()
+            if (state["_loaded_version"] != self._version() or len(state["_lengths"]) != len(state["ids"])
+                    or len(state["_offsets"]) != len(state["_terms"]) + 1):
+                return False
+            with self._lock:
+                if self._pending or self._deleted:
+                    return False
+                self.__dict__.update(state)
+            return True
+        finally:
+            self._refreshing.release()
+
+    def __len__(self):
+        return len(self.ids) - len(self._deleted)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._id_to_doc
+
+    def add(self, ids, texts, metadatas=None):
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            self._delete(ids)
+            lengths = []
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                doc = len(self.ids)
+                self.ids.append(doc_id)
+                self.texts.append(text)
+                self.metadatas.append(metadata)
+                self._id_to_doc[doc_id] = doc
+                tokens = tokenize(text)
+                for term, tf in Counter(tokens).items():
+                    self._pending.setdefault(term, []).append((doc, min(tf, 65535)))
+                lengths.append(len(tokens))
+            self._lengths = np.concatenate([self._lengths, np.asarray(lengths, dtype=np.uint32)])
+            self._total_length += sum(lengths)
+
+    def _delete(self, ids):
+        for doc_id in ids:
+            doc = self._id_to_doc.pop(doc_id, None)
+            if doc is not None:
+                self._deleted.add(doc)
+                self._total_length -= int(self._lengths[doc])
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+
+    # Document numbers and term frequencies of one term, stored and pending
+    def _posting(self, term):
+        docs, tfs = [], []
+        term_id = self._terms.get(term)
+        if term_id is not None:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            docs.append(np.asarray(self._postings[start:end], dtype=np.int64))
+            tfs.append(np.asarray(self._tfs[start:end], dtype=np.float32))
+        pending = self._pending.get(term)
+        if pending:
+            docs.append(np.fromiter((d for d, _ in pending), dtype=np.int64, count=len(pending)))
+            tfs.append(np.fromiter((t for _, t in pending), dtype=np.float32, count=len(pending)))
+        if not docs:
+            return None, None
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    # BM25 top-k as (Document, score) pairs, best first
+    def search(self, query, k=4):
+        self.refresh()
+        with self._lock, span("lexical.search"):
+            live = len(self)
+            if not live:
+                return []
+            avgdl = max(self._total_length / live, 1.0)
+            scores = np.zeros(len(self.ids), dtype=np.float32)
+            lengths = self._lengths.astype(np.float32)
+            deleted = None
+            if self._deleted:
+                deleted = np.zeros(len(self.ids), dtype=bool)
+                deleted[list(self._deleted)] = True
+            for term in set(tokenize(query)):
+                docs, tfs = self._posting(term)
+                if docs is None:
+                    continue
+                # Deleted documents count neither for the score nor the document frequency
+                if deleted is not None:
+                    keep = ~deleted[docs]
+                    docs, tfs = docs[keep], tfs[keep]
+                    if not len(docs):
+                        continue
+                idf = math.log(1 + (live - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = tfs + self.k1 * (1 - self.b + self.b * lengths[docs] / avgdl)
+                scores[docs] += idf * tfs * (self.k1 + 1) / norm
+            candidates = np.flatnonzero(scores > 0)
+            if not len(candidates):
+                return []
+            top = candidates[np.argsort(-scores[candidates])[:k]]
+            return [(Document(id=self.ids[d], page_content=self.texts[d], metadata=self.metadatas[d]),
+                     float(scores[d])) for d in top]
+
+    # Rewrite the index files with every live document, dropping deleted ones
+    def save(self):
+        with self._lock:
+            live = [d for d in range(len(self.ids)) if d not in self._deleted]
+            renumber = np.full(len(self.ids), -1, dtype=np.int64)
+            renumber[live] = np.arange(len(live))
+
+            terms = sorted(set(self._terms) | set(self._pending))
+            offsets, postings, tfs = [0], [], []
+            for term in terms:
+                docs, term_tfs = self._posting(term)
+                keep = renumber[docs] >= 0
+                postings.append(renumber[docs][keep].astype(np.uint32))
+                tfs.append(term_tfs[keep].astype(np.uint16))
+                offsets.append(offsets[-1] + int(keep.sum()))
+
+            os.makedirs(self.path, exist_ok=True)
+            arrays = {
+                "offsets.npy": np.asarray(offsets, dtype=np.int64),
+                "postings.npy": np.concatenate(postings) if postings else np.empty(0, dtype=np.uint32),
+                "tfs.npy": np.concatenate(tfs) if tfs else np.empty(0, dtype=np.uint16),
+                "lengths.npy": self._lengths[live].astype(np.uint32),
+            }
+            self._offsets = self._postings = self._tfs = None
+            for name, array in arrays.items():
+                with open(self._file(name + ".tmp"), "wb") as f:
+                    np.save(f, array)
+            with open(self._file("docs.jsonl.tmp"), "w", encoding="utf-8") as f:
+                for d in live:
+                    f.write(json.dumps({"id": self.ids[d], "text": self.texts[d], "metadata": self.metadatas[d]},
+                                       ensure_ascii=False) + "\n")
+            with open(self._file("terms.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump(terms, f, ensure_ascii=False)
+            for name in list(arrays) + ["docs.jsonl", "terms.json"]:
+                os.replace(self._file(name + ".tmp"), self._file(name))
+            self._load()
+
+
+# Shared pool so the dense and lexical searches of a query run at the same time
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+
+class HybridRetriever(BaseRetriever):
+    # Runs the dense vector search and the BM25 search concurrently and merges the two
+    # rankings with reciprocal rank fusion, so exact drug names and Indonesian terms that
+    # the English MiniLM model misses are still found. With lambda_mult below 1 the k
+    # results are picked by maximal marginal relevance, with the word overlap of two
+    # chunks as their similarity, so near-identical chunks do not fill the context.
+    # While the lexical index is empty (not built yet) queries use the dense search alone.
+
+    vector_store: Any
+    lexical_index: Any
+    k: int = 3
+    fetch_k: int = 10
+    rrf_k: int = 60
+    lambda_mult: float = 1.0
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        self.lexical_index.refresh()
+        if not len(self.lexical_index):
+            if self.lambda_mult < 1:
+                return self.vector_store.max_marginal_relevance_search(query, k=self.k, fetch_k=self.fetch_k,
+                                                                       lambda_mult=self.lambda_mult)
+            return self.vector_store.similarity_search(query, k=self.k)
+        # Each search runs in a copy of the caller's context so its spans join the caller's trace
+        dense = _search_pool.submit(contextvars.copy_context().run, self.vector_store.similarity_search,
+                                    query, k=self.fetch_k)
+        lexical = _search_pool.submit(contextvars.copy_context().run, self.lexical_index.search,
+                                      query, self.fetch_k)
+        rankings = [dense.result(), [doc for doc, _ in lexical.result()]]
+
+        scores, documents = {}, {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking):
+                key = doc.page_content
+                documents.setdefault(key, doc)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        if self.lambda_mult >= 1:
+            return [documents[key] for key in ranked[:self.k]]
+        relevance = np.array([scores[key] for key in ranked])
+        texts = [shingles(key) for key in ranked]
+        selected = mmr(relevance / relevance.max(), lambda j: [jaccard(text, texts[j]) for text in texts],
+                       self.k, self.lambda_mult)
+        return [documents[ranked[i]] for i in selected]
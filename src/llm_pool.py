@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import queue
+import threading
+import contextvars
+from typing import Any
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRY_STATUSES = frozenset((408, 409, 429, 500, 502, 503, 504))
+
+_END = object()
+
+
+class TokenBucket:
+    # Allows `rate` acquisitions per second on average and bursts of up to `capacity`
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Block until a token is available; returns the seconds spent waiting
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# Whether a failed call may succeed if tried again, and how long the provider asked to wait
+def retry_policy(error):
+    status = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    retry_after = None
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    if status is not None:
+        return status in RETRY_STATUSES, retry_after
+    # Connection and timeout errors of the HTTP clients carry no status
+    retryable = isinstance(error, (TimeoutError, ConnectionError)) or any(
+        word in type(error).__name__ for word in ("Timeout", "Connection"))
+    return retryable, retry_after
+
+
+class _Flight:
+    # One completion in progress and the chunks it produced so far, shared by every
+    # identical request that arrives while it runs
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._condition = threading.Condition()
+
+    def add(self, chunk):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, error=None):
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+
+    # Every chunk from the first one on, as they arrive; raises the flight's error
+    def follow(self):
+        position = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.done or len(self.chunks) > position)
+                chunks, done, error = self.chunks[position:], self.done, self.error
+            yield from chunks
+            position += len(chunks)
+            if done and position == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class LLMClientPool:
+    # Calls to the LLM provider with limits and failure handling around them:
+    # - a token bucket caps the request rate (LLM_REQUESTS_PER_MINUTE, LLM_BURST), and at
+    #   most max_concurrency calls (LLM_MAX_CONCURRENCY) run at a time;
+    # - a call that produces nothing for timeout seconds (LLM_TIMEOUT: until the first
+    #   chunk, then between chunks) is abandoned;
+    # - timeouts, connection errors, rate limits and server errors are retried up to
+    #   max_retries times (LLM_MAX_RETRIES) after a jittered exponential backoff, or
+    #   after the provider's Retry-After;
+    # - if the primary model still fails, the fallback model (if any) is tried the same way;
+    # - identical requests made while one is in flight share its completion (LLM_COALESCE).
+    # A call that already streamed part of its answer is not retried, since the caller
+    # has shown that part.
+
+    def __init__(self, model, fallback=None, max_concurrency=None, requests_per_minute=None, burst=None,
+                 timeout=None, max_retries=None, backoff=0.5, max_backoff=8.0, coalesce=None):
+        self.model = model
+        self.fallback = fallback
+        self.max_concurrency = max_concurrency or int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+        rate = requests_per_minute or float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "30"))
+        self.bucket = TokenBucket(rate / 60, burst or int(os.environ.get("LLM_BURST", "5")))
+        self.timeout = timeout or float(os.environ.get("LLM_TIMEOUT", "30"))
+        self.max_retries = int(os.environ.get("LLM_MAX_RETRIES", "3")) if max_retries is None else max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        if coalesce is None:
+            coalesce = os.environ.get("LLM_COALESCE", "true").lower() in ("1", "true", "yes")
+        self.coalesce = coalesce
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "coalesced": 0, "attempts": 0, "retries": 0, "timeouts": 0,
+                       "fallbacks": 0, "failures": 0}
+        self.rate_limit_wait = 0.0
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def _key(self, messages, stop, kwargs):
+        payload = json.dumps([[(m.type, m.content) for m in messages], stop, kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Message chunks of the completion of messages, as they arrive
+    def stream(self, messages, stop=None, **kwargs):
+        key = self._key(messages, stop, kwargs) if self.coalesce else None
+        with self._lock:
+            self.counts["requests"] += 1
+            flight = self._flights.get(key) if key else None
+            if flight is not None:
+                self.counts["coalesced"] += 1
+            else:
+                flight = _Flight()
+                if key:
+                    self._flights[key] = flight
+                # The flight runs on its own thread so it completes for every request
+                # sharing it even if this one stops reading; its spans join this trace
+                threading.Thread(target=contextvars.copy_context().run, name="llm-flight", daemon=True,
+                                 args=(self._fly, flight, key, messages, stop, kwargs)).start()
+        return flight.follow()
+
+    # The whole completion as one message
+    def generate(self, messages, stop=None, **kwargs):
+        return AIMessage(content="".join(str(chunk.content) for chunk in self.stream(messages, stop, **kwargs)))
+
+    def _fly(self, flight, key, messages, stop, kwargs):
+        error = None
+        try:
+            models = [self.model] + ([self.fallback] if self.fallback is not None else [])
+            for number, model in enumerate(models):
+                if number:
+                    self._count("fallbacks")
+                    logger.warning("LLM call failed (%s), trying the fallback model", error)
+                error = self._call_with_retries(flight, model, messages, stop, kwargs)
+                if error is None or flight.chunks:
+                    break
+            if error is not None:
+                self._count("failures")
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                if key and self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.finish(error)
+
+    # Try one model until it succeeds or the retries run out; returns the last error or None
+    def _call_with_retries(self, flight, model, messages, stop, kwargs):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                retryable, retry_after = retry_policy(error)
+                if not retryable or flight.chunks:
+                    return error
+                self._count("retries")
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+                time.sleep(max(delay, retry_after or 0.0))
+            waited = self.bucket.acquire()
+            with self._lock:
+                self.rate_limit_wait += waited
+                self.counts["attempts"] += 1
+            try:
+                with span("llm.attempt", fallback=model is not self.model, retry=attempt > 0):
+                    self._attempt(flight, model, messages, stop, kwargs)
+                return None
+            except Exception as e:
+                error = e
+        return error
+
+    # One call, run on a separate thread so it can be abandoned when it stalls. An abandoned
+    # call gives its concurrency slot back at once, so calls stuck at the provider do not
+    # hold up the retries.
+    def _attempt(self, flight, model, messages, stop, kwargs):
+        self._slots.acquire()
+        pieces = queue.Queue()
+        abandoned = threading.Event()
+        released = threading.Lock()
+
+        def release():
+            if released.acquire(blocking=False):
+                self._slots.release()
+
+        def call():
+            try:
+                for chunk in model.stream(messages, stop=stop, **kwargs):
+                    if abandoned.is_set():
+                        return
+                    pieces.put(chunk)
+                pieces.put(_END)
+            except Exception as e:
+                pieces.put(e)
+            finally:
+                release()
+
+        threading.Thread(target=call, name="llm-call", daemon=True).start()
+        while True:
+            try:
+                piece = pieces.get(timeout=self.timeout)
+            except queue.Empty:
+                abandoned.set()
+                release()
+                self._count("timeouts")
+                raise TimeoutError(f"No response from the LLM for {self.timeout}s")
+            if piece is _END:
+                return
+            if isinstance(piece, Exception):
+                raise piece
+            flight.add(piece)
+
+    # Request counters, plus the seconds spent waiting for the rate limiter
+    def stats(self):
+        with self._lock:
+            return {**self.counts, "rate_limit_wait_seconds": round(self.rate_limit_wait, 3)}
+
+
+class PooledChatModel(BaseChatModel):
+    # Chat model that sends its calls through an LLMClientPool, so chains, streaming and
+    # the memory summarizer all get the pool's limits, retries and coalescing
+
+    pool: Any
+
+    @property
+    def _llm_type(self):
+        return "pooled-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self.pool.generate(messages, stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for piece in self.pool.stream(messages, stop, **kwargs):
+            chunk = ChatGenerationChunk(message=piece)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+# Wrap a chat model (and an optional fallback) in a pool configured from the environment
+def pooled_model(model, fallback=None, **settings):
+    return PooledChatModel(pool=LLMClientPool(model, fallback, **settings))
@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+
+
+# Hash a file's contents in blocks so large files are not read into memory at once
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Deterministic chunk ID: the same text from the same source always gets the same ID,
+# so editing one part of a document does not shift the IDs of the other chunks
+def chunk_id(source, text):
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class IngestionManifest:
+    # Records, per source file, its content hash and the IDs of the chunks that were
+    # stored in the index for it. store_index.py compares the files under Data/ against
+    # it to decide what has to be parsed, embedded, upserted or deleted.
+
+    def __init__(self, path, index_name):
+        self.path = path
+        self.index_name = index_name
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            # A manifest written for another index says nothing about this one
+            if data.get("index_name") == index_name:
+                self.files = data.get("files", {})
+
+    # Return the file's new content hash if it is new or changed, otherwise None
+    def changed(self, path):
+        entry = self.files.get(path)
+        stat = os.stat(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return None
+        digest = file_hash(path)
+        if entry and entry["hash"] == digest:
+            # Touched but not modified: remember the new mtime so it is not hashed again
+            entry["mtime"] = stat.st_mtime
+            return None
+        return digest
+
+    # Files recorded in the manifest that are no longer present
+    def removed(self, paths):
+        return sorted(set(self.files) - set(paths))
+
+    def chunk_ids(self, path):
+        return self.files.get(path, {}).get("chunks", [])
+
+    def record(self, path, digest, chunk_ids):
+        stat = os.stat(path)
+        self.files[path] = {
+            "hash": digest,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "chunks": list(chunk_ids),
+        }
+
+    def forget(self, path):
+        self.files.pop(path, None)
+
+    # Write atomically so an interrupted run never leaves a truncated manifest
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"index_name": self.index_name, "files": self.files}, f, indent=1)
+        os.replace(tmp_path, self.path)
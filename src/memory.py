@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from src.context import estimate_tokens
+
+# Summarizer calls run here, off the response path (MEMORY_SUMMARY_WORKERS)
+_summary_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("MEMORY_SUMMARY_WORKERS", "2")),
+                                   thread_name_prefix="memory-summary")
+
+
+class SessionMemory:
+    # Conversation memory of one session: the last few turns verbatim plus a running
+    # summary of everything older, kept under a hard token cap.
+
+    def __init__(self, summarize=None, window_turns=6, max_tokens=1200):
+        self.summarize = summarize
+        self.window_turns = window_turns
+        self.max_tokens = max_tokens
+        self.turns = deque()
+        self.summary = ""
+        # Turns of the whole session so far, numbering the turns saved to MongoDB
+        self.turn_count = 0
+        self.last_used = time.time()
+        # Turns that left the window and are not in the summary yet
+        self._pending = []
+        self._lock = threading.Lock()
+        self._summarizing = threading.Lock()
+
+    # Add a completed turn; returns its number in the session (from 0)
+    def add_turn(self, user_input, bot_response):
+        with self._lock:
+            self.turns.append((user_input, bot_response))
+            self.turn_count += 1
+            turn = self.turn_count - 1
+            while len(self.turns) > self.window_turns or (
+                    len(self.turns) > 1 and estimate_tokens(self._format(self.turns)) > self.max_tokens):
+                self._pending.append(self.turns.popleft())
+            self.last_used = time.time()
+            if self._pending:
+                _summary_pool.submit(self._fold)
+            return turn
+
+    # Refill the memory from stored turns (e.g. after a restart): the most recent turns go
+    # into the window and everything older is summarized in one call. turn_count is the
+    # number of turns the session had, if more than were stored.
+    def restore(self, turns, turn_count=None):
+        with self._lock:
+            turns = list(turns)
+            older, recent = turns[:-self.window_turns], turns[-self.window_turns:]
+            self.turns = deque(recent)
+            self.turn_count = max(turn_count or 0, len(turns))
+            self._pending.extend(older)
+            self.last_used = time.time()
+            if self._pending:
+                _summary_pool.submit(self._fold)
+
+    # Fold the pending turns into the summary, on the summary pool. The summarizer (an LLM
+    # call) runs without holding the lock history() needs, and one fold at a time so none
+    # is lost; until it returns, the pending turns stay in the history verbatim.
+    def _fold(self):
+        with self._summarizing:
+            with self._lock:
+                summary, evicted = self.summary, list(self._pending)
+            if not evicted:
+                return
+            summary = self._summarize(summary, evicted)
+            with self._lock:
+                self.summary = summary
+                del self._pending[:len(evicted)]
+
+    # Extend the summary with turns that left the window; without a summarizer (or if it
+    # fails) keep the tail of the plain transcript instead. Either way the summary is cut
+    # to max_tokens.
+    def _summarize(self, summary, evicted):
+        text = None
+        if self.summarize is not None:
+            try:
+                text = self.summarize(summary, evicted)
+            except Exception:
+                pass
+        if text is None:
+            transcript = "\n".join(f"User: {u}\nAssistant: {a}" for u, a in evicted)
+            text = f"{summary}\n{transcript}".strip()
+        if estimate_tokens(text) > self.max_tokens:
+            text = text[-self.max_tokens * 4:]
+        return text
+
+    def _format(self, turns):
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation:\n{self.summary}")
+        parts.extend(f"User: {u}\nAssistant: {a}" for u, a in turns)
+        return "\n".join(parts)
+
+    # The history to put in the prompt, never longer than max_tokens
+    def history(self):
+        with self._lock:
+            self.last_used = time.time()
+            text = self._format(self._pending + list(self.turns))
+            if estimate_tokens(text) > self.max_tokens:
+                text = text[-self.max_tokens * 4:]
+            return text
+
+
+class SessionMemoryStore:
+    # SessionMemory per session ID. Sessions idle longer than the TTL are dropped and the
+    # least recently used ones are evicted beyond max_sessions, so server memory stays
+    # bounded however many users connect.
+
+    def __init__(self, summarize=None, window_turns=None, max_tokens=None, ttl=None, max_sessions=None):
+        self.summarize = summarize
+        self.window_turns = window_turns or int(os.environ.get("MEMORY_WINDOW_TURNS", "6"))
+        self.max_tokens = max_tokens or int(os.environ.get("MEMORY_MAX_TOKENS", "1200"))
+        self.ttl = ttl or float(os.environ.get("MEMORY_SESSION_TTL", "3600"))
+        self.max_sessions = max_sessions or int(os.environ.get("MEMORY_MAX_SESSIONS", "1000"))
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            memory = self._sessions.get(session_id)
+            if memory is None:
+                # Only a new session needs room
+                self._evict()
+                memory = SessionMemory(self.summarize, self.window_turns, self.max_tokens)
+                self._sessions[session_id] = memory
+            self._sessions.move_to_end(session_id)
+            return memory
+
+    def _evict(self):
+        now = time.time()
+        for session_id in [s for s, m in self._sessions.items() if now - m.last_used > self.ttl]:
+            del self._sessions[session_id]
+        while len(self._sessions) >= self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# Build a summarize(summary, turns) function that asks the LLM to extend the summary
+def llm_summarizer(llm, summary_prompt):
+    def summarize(summary, turns):
+        transcript = "\n".join(f"User: {u}\nAssistant: {a}" for u, a in turns)
+        response = llm.invoke(summary_prompt.format(summary=summary or "(none)", new_lines=transcript))
+        return getattr(response, "content", response).strip()
+    return summarize
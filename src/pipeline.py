@@ -0,0 +1,354 @@
+import os
+import csv
+import json
+import time
+import queue
+import threading
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from src.manifest import chunk_id
+from src.tracing import span
+
+_DONE = object()
+
+
+# Split one text the same way text_split() does (imported here so worker processes get it too)
+def _splitter(chunk_size, chunk_overlap):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+# Number of pages in a PDF (only reads the page tree, not the page contents)
+def _pdf_page_count(file_path):
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+# Worker process: extract and split pages [start, end) of one PDF
+def _parse_pdf_pages(file_path, start, end, chunk_size, chunk_overlap):
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    splitter = _splitter(chunk_size, chunk_overlap)
+    pages = []
+    for page_number in range(start, end):
+        text = reader.pages[page_number].extract_text() or ""
+        pages.append((page_number, splitter.split_text(text)))
+    return pages
+
+
+# Stream the rows of a CSV file as chunks, formatted like CSVLoader does
+def _iter_csv_chunks(file_path, splitter):
+    with open(file_path, newline="", encoding="utf-8") as f:
+        for row_number, row in enumerate(csv.DictReader(f)):
+            text = "\n".join(f"{(k or '').strip()}: {(v or '').strip()}" for k, v in row.items())
+            for chunk in splitter.split_text(text):
+                yield chunk, {"source": file_path, "row": row_number}
+
+
+class _StageStats:
+    # Chunk count, busy time and time of the last output of one pipeline stage
+
+    def __init__(self, started):
+        self.started = started
+        self.finished = started
+        self.count = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, count, seconds):
+        with self._lock:
+            self.count += count
+            self.busy += seconds
+            self.finished = time.perf_counter()
+
+    # Chunks per second over the time the stage took to produce all of its output
+    def report(self):
+        elapsed = self.finished - self.started
+        return {"chunks": self.count, "busy_seconds": round(self.busy, 3),
+                "chunks_per_second": round(self.count / elapsed, 1) if elapsed > 0 else 0.0}
+
+
+class IngestionPipeline:
+    # Staged ingestion: PDFs are parsed a few pages at a time in a process pool and CSVs
+    # are streamed row by row, chunks flow through a bounded queue to a single embedding
+    # stage that embeds fixed-size batches, and the vectors are upserted in size-capped
+    # batches by a small thread pool. Every stage has a bounded backlog, so memory stays
+    # flat however large the corpus is. If a lexical index is given, every chunk is also
+    # added to it (including already indexed chunks it is missing). If a near-duplicate
+    # index is given, chunks that nearly repeat a kept chunk are dropped before embedding.
+
+    def __init__(self, embeddings, index, embed_batch_size=64, upsert_batch_size=100,
+                 upsert_max_bytes=2_000_000, upsert_workers=4, parse_workers=None,
+                 pages_per_task=4, queue_size=1024, chunk_size=500, chunk_overlap=20,
+                 lexical_index=None, dedup_index=None):
+        self.embeddings = embeddings
+        self.index = index
+        self.lexical_index = lexical_index
+        self.dedup_index = dedup_index
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_max_bytes = upsert_max_bytes
+        self.upsert_workers = upsert_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    # Ingest file_paths into the index. skip_ids maps a file to chunk IDs that are already
+    # indexed and need no embedding; on_file_done(file_path, chunk_ids) is called once every
+    # chunk of a file has been upserted (chunk_ids includes dropped near-duplicates).
+    # Returns per-stage throughput stats and, with a near-duplicate index, what it dropped.
+    def run(self, file_paths, skip_ids=None, on_file_done=None):
+        with span("ingest.run", files=len(file_paths)) as s:
+            report = self._run(file_paths, skip_ids, on_file_done)
+            s.set(chunks=report["embed"]["chunks"])
+        return report
+
+    def _run(self, file_paths, skip_ids, on_file_done):
+        self._skip_ids = skip_ids or {}
+        self._on_file_done = on_file_done
+        self._chunks = queue.Queue(maxsize=self.queue_size)
+        self._stop = threading.Event()
+        self._errors = []
+        self._files = {}
+        self._files_lock = threading.Lock()
+        self._upsert_slots = threading.BoundedSemaphore(self.upsert_workers * 2)
+        started = time.perf_counter()
+        self.stats = {stage: _StageStats(started) for stage in ("parse", "embed", "upsert")}
+        self._dedup = {"chunks": 0, "duplicates": 0, "not_embedded": 0, "characters": 0, "seconds": 0.0}
+
+        pdf_paths = [p for p in file_paths if p.lower().endswith(".pdf")]
+        csv_paths = [p for p in file_paths if p.lower().endswith(".csv")]
+        for file_path in pdf_paths + csv_paths:
+            self._files[file_path] = {"ids": {}, "pending": 0, "parsed": False}
+
+        # Stage threads run in copies of this context, so their spans join the "ingest.run" trace
+        producers = [
+            threading.Thread(target=contextvars.copy_context().run, args=(self._guard, self._produce_pdfs, pdf_paths)),
+            threading.Thread(target=contextvars.copy_context().run, args=(self._guard, self._produce_csvs, csv_paths)),
+        ]
+        with ThreadPoolExecutor(max_workers=self.upsert_workers) as upserter:
+            self._upserter = upserter
+            embedder = threading.Thread(target=contextvars.copy_context().run,
+                                        args=(self._guard, self._embed, len(producers)))
+            for thread in producers + [embedder]:
+                thread.start()
+            for thread in producers + [embedder]:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        report = {stage: stats.report() for stage, stats in self.stats.items()}
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        if self.dedup_index is not None:
+            report["dedup"] = self._dedup_report()
+        return report
+
+    # Chunks dropped as near-duplicates, the share of the index they would have taken, and
+    # the embedding time they would have cost at this run's average seconds per chunk
+    def _dedup_report(self):
+        dedup, embed = self._dedup, self.stats["embed"]
+        per_chunk = embed.busy / embed.count if embed.count else 0.0
+        return {
+            "chunks": dedup["chunks"],
+            "duplicates": dedup["duplicates"],
+            "index_shrink": round(dedup["duplicates"] / dedup["chunks"], 3) if dedup["chunks"] else 0.0,
+            "characters_dropped": dedup["characters"],
+            "detection_seconds": round(dedup["seconds"], 3),
+            "embedding_seconds_saved": round(dedup["not_embedded"] * per_chunk, 3),
+        }
+
+    # Run a stage, recording its exception and stopping the other stages on failure
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    # Blocking put that gives up once another stage has failed
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _emit(self, file_path, text, metadata):
+        doc_id = chunk_id(file_path, text)
+        with self._files_lock:
+            state = self._files[file_path]
+            if doc_id in state["ids"]:
+                return
+            state["ids"][doc_id] = None
+        if self.dedup_index is not None and self._is_duplicate(file_path, doc_id, text):
+            return
+        with self._files_lock:
+            if doc_id in self._skip_ids.get(file_path, ()):
+                if self.lexical_index is not None and doc_id not in self.lexical_index:
+                    self.lexical_index.add([doc_id], [text], [metadata])
+                return
+            state["pending"] += 1
+        self._put((file_path, doc_id, text, metadata))
+
+    # Whether a chunk nearly duplicates one already kept (in this run or an earlier one)
+    def _is_duplicate(self, file_path, doc_id, text):
+        began = time.perf_counter()
+        duplicate = self.dedup_index.check(doc_id, text) is not None
+        with self._files_lock:
+            self._dedup["chunks"] += 1
+            self._dedup["seconds"] += time.perf_counter() - began
+            if duplicate:
+                self._dedup["duplicates"] += 1
+                self._dedup["characters"] += len(text)
+                if doc_id not in self._skip_ids.get(file_path, ()):
+                    self._dedup["not_embedded"] += 1
+        return duplicate
+
+    def _file_parsed(self, file_path):
+        with self._files_lock:
+            self._files[file_path]["parsed"] = True
+        self._check_file_done(file_path)
+
+    def _check_file_done(self, file_path):
+        with self._files_lock:
+            state = self._files[file_path]
+            if not state["parsed"] or state["pending"] or state.get("done"):
+                return
+            state["done"] = True
+            chunk_ids = list(state["ids"])
+        if self._on_file_done:
+            self._on_file_done(file_path, chunk_ids)
+
+    def _produce_pdfs(self, pdf_paths):
+        try:
+            if not pdf_paths:
+                return
+            remaining = {}
+            tasks = []
+            for file_path in pdf_paths:
+                pages = _pdf_page_count(file_path)
+                starts = list(range(0, pages, self.pages_per_task))
+                remaining[file_path] = len(starts)
+                tasks.extend((file_path, start, min(start + self.pages_per_task, pages)) for start in starts)
+                if not starts:
+                    self._file_parsed(file_path)
+
+            # Keep only a few tasks in flight so parsed pages never pile up in memory; tasks
+            # are consumed in submission order, so a big PDF only delays its own pages
+            with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+                window = []
+                for task in tasks:
+                    if self._stop.is_set():
+                        break
+                    window.append((task, pool.submit(_parse_pdf_pages, *task, self.chunk_size, self.chunk_overlap)))
+                    if len(window) >= self.parse_workers * 2:
+                        self._collect(window.pop(0), remaining)
+                while window and not self._stop.is_set():
+                    self._collect(window.pop(0), remaining)
+                for _, future in window:
+                    future.cancel()
+        finally:
+            self._put(_DONE)
+
+    def _collect(self, submitted, remaining):
+        (file_path, start, end), future = submitted
+        began = time.perf_counter()
+        with span("ingest.parse_pages", pages=end - start) as s:
+            pages = future.result()
+            s.set(chunks=sum(len(chunks) for _, chunks in pages))
+        count = 0
+        for page_number, chunks in pages:
+            for text in chunks:
+                self._emit(file_path, text, {"source": file_path, "page": page_number})
+                count += 1
+        self.stats["parse"].add(count, time.perf_counter() - began)
+        remaining[file_path] -= 1
+        if remaining[file_path] == 0:
+            self._file_parsed(file_path)
+
+    def _produce_csvs(self, csv_paths):
+        try:
+            splitter = _splitter(self.chunk_size, self.chunk_overlap)
+            for file_path in csv_paths:
+                began, count = time.perf_counter(), 0
+                for text, metadata in _iter_csv_chunks(file_path, splitter):
+                    if self._stop.is_set():
+                        return
+                    self._emit(file_path, text, metadata)
+                    count += 1
+                self.stats["parse"].add(count, time.perf_counter() - began)
+                self._file_parsed(file_path)
+        finally:
+            self._put(_DONE)
+
+    def _embed(self, producers):
+        batch = []
+        while producers:
+            try:
+                item = self._chunks.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is _DONE:
+                producers -= 1
+            else:
+                batch.append(item)
+            if len(batch) >= self.embed_batch_size or (batch and not producers):
+                self._embed_batch(batch)
+                batch = []
+            if self._stop.is_set():
+                return
+
+    def _embed_batch(self, batch):
+        began = time.perf_counter()
+        texts = [text for _, _, text, _ in batch]
+        with span("ingest.embed_batch", chunks=len(texts), characters=sum(len(text) for text in texts)):
+            vectors = self.embeddings.embed_documents(texts)
+        self.stats["embed"].add(len(batch), time.perf_counter() - began)
+
+        records, size = [], 0
+        for (file_path, doc_id, text, metadata), values in zip(batch, vectors):
+            record = {"id": doc_id, "values": list(values), "metadata": {**metadata, "text": text}}
+            record_size = len(json.dumps(record))
+            if records and (len(records) >= self.upsert_batch_size or size + record_size > self.upsert_max_bytes):
+                self._submit_upsert(records, size)
+                records, size = [], 0
+            records.append(record)
+            size += record_size
+        if records:
+            self._submit_upsert(records, size)
+
+    # Hand a batch to the upsert pool, blocking while too many batches are in flight
+    def _submit_upsert(self, records, size):
+        self._upsert_slots.acquire()
+        future = self._upserter.submit(contextvars.copy_context().run, self._upsert, records, size)
+        future.add_done_callback(lambda _: self._upsert_slots.release())
+
+    def _upsert(self, records, size):
+        try:
+            began = time.perf_counter()
+            with span("ingest.upsert", records=len(records), bytes=size):
+                self.index.upsert(vectors=records)
+            self.stats["upsert"].add(len(records), time.perf_counter() - began)
+            if self.lexical_index is not None:
+                self.lexical_index.add(
+                    [record["id"] for record in records],
+                    [record["metadata"]["text"] for record in records],
+                    [{k: v for k, v in record["metadata"].items() if k != "text"} for record in records],
+                )
+            done = set()
+            with self._files_lock:
+                for record in records:
+                    file_path = record["metadata"]["source"]
+                    self._files[file_path]["pending"] -= 1
+                    done.add(file_path)
+            for file_path in done:
+                self._check_file_done(file_path)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
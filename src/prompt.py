@@ -66,4 +66,13 @@ system_prompt = (
     "\n\nRelevant Context from Documents:\n{context}\n\n"
     "Conversation History (Previous Interactions):\n{history}\n\n"
     "User Query (Current Question):\n{input}"
+)
+
+summary_prompt = (
+    "Progressively summarize the conversation between a user and Doctor AI, adding onto the previous summary."
+    " Keep symptoms, conditions, medications, uploaded document topics and any advice already given."
+    " Write at most five sentences and return only the new summary."
+    "\n\nCurrent summary:\n{summary}\n\n"
+    "New lines of conversation:\n{new_lines}\n\n"
+    "New summary:"
 )
\ No newline at end of file
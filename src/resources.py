@@ -0,0 +1,210 @@
+import os
+import time
+import logging
+import functools
+import threading
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "medical-chatbot"
+PROCESS_STARTED = time.perf_counter()
+
+# Build times of each resource and first-occurrence times of app events, in seconds
+timings = {}
+
+_resources = {}
+
+
+# Build a resource once per process on first use and share it with every session and
+# every Streamlit rerun; heavy libraries are only imported inside the builders
+def shared_resource(build):
+    lock = threading.Lock()
+
+    @functools.wraps(build)
+    def get():
+        if build.__name__ not in _resources:
+            with lock:
+                if build.__name__ not in _resources:
+                    started = time.perf_counter()
+                    _resources[build.__name__] = build()
+                    timings[build.__name__] = round(time.perf_counter() - started, 3)
+                    logger.info("Built %s in %.2fs", build.__name__, timings[build.__name__])
+        return _resources[build.__name__]
+    return get
+
+
+# Use value as a resource instead of building it (local stand-ins for benchmarks)
+def provide(get, value):
+    _resources[get.__name__] = value
+
+
+# Log how long after process start an event (first render, first response...) first happened
+def mark_once(event):
+    if event not in timings:
+        timings[event] = round(time.perf_counter() - PROCESS_STARTED, 3)
+        logger.info("%s %.2fs after startup", event, timings[event])
+
+
+@shared_resource
+def get_embeddings():
+    from src.helper import download_hugging_face_embeddings
+    # Queries from concurrent sessions are embedded in shared batches (EMBEDDING_BATCHING)
+    batching = os.environ.get("EMBEDDING_BATCHING", "true").lower() in ("1", "true", "yes")
+    return download_hugging_face_embeddings(batch_queries=batching)
+
+
+# The same model without the disk cache, for uploaded documents: their chunks are one
+# session's data and must not be written to EMBEDDING_CACHE_PATH
+@shared_resource
+def get_upload_embeddings():
+    return get_embeddings().embeddings
+
+
+@shared_resource
+def get_docsearch():
+    from src.vector_store import get_vector_store
+    # Pinecone or the local on-disk index, see VECTOR_STORE
+    return get_vector_store(INDEX_NAME, get_embeddings())
+
+
+@shared_resource
+def get_lexical_index():
+    from src.lexical import get_lexical_index
+    return get_lexical_index(INDEX_NAME)
+
+
+# Dense and BM25 search fused (RETRIEVAL_MODE=hybrid, the default; dense search only while
+# store_index.py has not built the lexical index yet), otherwise dense search only. The 3
+# results are diversified with maximal marginal relevance unless RETRIEVAL_MMR_LAMBDA is 1.
+@shared_resource
+def get_retriever():
+    fetch_k = int(os.environ.get("HYBRID_FETCH_K", "10"))
+    lambda_mult = float(os.environ.get("RETRIEVAL_MMR_LAMBDA", "0.7"))
+    if os.environ.get("RETRIEVAL_MODE", "hybrid").lower() == "hybrid":
+        from src.lexical import HybridRetriever
+        return HybridRetriever(vector_store=get_docsearch(), lexical_index=get_lexical_index(), k=3,
+                               fetch_k=fetch_k, lambda_mult=lambda_mult)
+    if lambda_mult < 1:
+        return get_docsearch().as_retriever(search_type="mmr",
+                                            search_kwargs={"k": 3, "fetch_k": fetch_k, "lambda_mult": lambda_mult})
+    return get_docsearch().as_retriever(search_type="similarity", search_kwargs={"k": 3})
+
+
+# Groq behind the client pool (src/llm_pool.py): rate limit, bounded concurrency, timeouts,
+# retries, coalescing of identical requests, and LLM_FALLBACK_MODEL if set. The Groq client
+# does not retry itself, the pool does.
+@shared_resource
+def get_llm():
+    from langchain_groq import ChatGroq
+    from src.llm_pool import pooled_model
+
+    def groq(model):
+        return ChatGroq(
+            model=model,
+            temperature=1,
+            max_tokens=1024,
+            verbose=True,
+            timeout=float(os.environ.get("LLM_TIMEOUT", "30")),
+            max_retries=0,
+        )
+
+    fallback = os.environ.get("LLM_FALLBACK_MODEL")
+    return pooled_model(groq("gemma-7b-it"), fallback=groq(fallback) if fallback else None)
+
+
+@shared_resource
+def get_prompt():
+    from langchain_core.prompts import ChatPromptTemplate
+    from src.prompt import system_prompt
+    # Define prompt with expected input variables 'context' and 'input'
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            ("human", "{history}\nUser: {input}"),
+        ]
+    )
+
+
+@shared_resource
+def get_conversation_chain():
+    from langchain.chains import LLMChain
+    # The session's history is passed in with each call
+    return LLMChain(llm=get_llm(), prompt=get_prompt(), verbose=True)
+
+
+@shared_resource
+def get_streaming_chain():
+    # Same prompt and model as the chain, streamed token by token
+    return get_prompt() | get_llm()
+
+
+@shared_resource
+def get_mongo_collection():
+    from pymongo import MongoClient
+    client = MongoClient(os.environ.get("MONGO_URI"))
+    return client["medical_chatbot"]["chat_history"]
+
+
+@shared_resource
+def get_history_writer():
+    from src.history import ChatHistoryWriter
+    # Turns are written in batches by a background thread instead of on the request path
+    return ChatHistoryWriter(get_mongo_collection())
+
+
+@shared_resource
+def get_answer_cache():
+    from src.answer_cache import SemanticAnswerCache
+    # Shared across sessions so near-duplicate questions skip the Groq call
+    return SemanticAnswerCache(get_embeddings())
+
+
+@shared_resource
+def get_session_memories():
+    from src.memory import SessionMemoryStore, llm_summarizer
+    from src.prompt import summary_prompt
+    # Recent turns plus a running summary per session, with idle sessions evicted
+    return SessionMemoryStore(summarize=llm_summarizer(get_llm(), summary_prompt))
+
+
+@shared_resource
+def get_structured_engine():
+    from src.structured import StructuredDataEngine
+    # The CSV datasets, queried with exact filters instead of per-row embeddings
+    return StructuredDataEngine.from_directory(os.environ.get("STRUCTURED_DATA_DIR", "Data/csv"))
+
+
+@shared_resource
+def get_upload_extractor():
+    from src.uploads import UploadExtractor
+    # Worker pool and content-hash cache for the text of uploaded PDFs
+    return UploadExtractor()
+
+
+# Build everything up front and run one embedding so the first user does not pay for
+# loading the model; returns the build timings
+def warm_up():
+    started = time.perf_counter()
+    for get in (get_embeddings, get_retriever, get_conversation_chain, get_streaming_chain,
+                get_history_writer, get_answer_cache, get_session_memories, get_structured_engine):
+        get()
+    get_embeddings().embed_query("warm up")
+    timings["warm_up"] = round(time.perf_counter() - started, 3)
+    logger.info("Warm-up finished in %.2fs", timings["warm_up"])
+    return dict(timings)
+
+
+# Read the tracing settings and start the metrics endpoint (METRICS_PORT) once per process
+@shared_resource
+def start_tracing():
+    from src import tracing
+    tracing.configure()
+    return tracing.start_metrics_server()
+
+
+# Start warm_up() in the background once per process, so the page renders immediately
+@shared_resource
+def start_warm_up():
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,18 @@
+import time
+
+
+# Yield the text of each chunk streamed by a runnable (e.g. prompt | llm) and record
+# time-to-first-token, total generation time and the number of chunks in metrics
+def stream_text(runnable, inputs, metrics):
+    started = time.perf_counter()
+    metrics["chunks"] = 0
+    for chunk in runnable.stream(inputs):
+        text = getattr(chunk, "content", chunk)
+        if not text:
+            continue
+        if "time_to_first_token" not in metrics:
+            metrics["time_to_first_token"] = round(time.perf_counter() - started, 3)
+        metrics["chunks"] += 1
+        yield text
+    metrics.setdefault("time_to_first_token", round(time.perf_counter() - started, 3))
+    metrics["generation_time"] = round(time.perf_counter() - started, 3)
@@ -0,0 +1,148 @@
+import os
+import re
+import glob
+import numpy as np
+import pandas as pd
+
+# Columns of each CSV whose values are indexed for lookups and matched in questions
+KEY_COLUMNS = {
+    "medicine_dataset.csv": ["Name", "Category", "Dosage Form", "Manufacturer", "Indication", "Classification"],
+    "Symptom-severity.csv": ["Symptom"],
+    "insurance.csv": ["region"],
+}
+
+# Phrases that mark a question as a lookup/listing/counting request (English and Indonesian),
+# matched as whole words
+LIST_INTENTS = ("which", "list", "show", "all", "apa saja", "daftar", "sebutkan", "mana saja", "yang mana")
+COUNT_INTENTS = ("how many", "count", "number of", "berapa", "jumlah")
+
+_TOKEN = re.compile(r"[\w&+-]+")
+
+
+def _intent_pattern(phrases):
+    return re.compile(r"\b(?:" + "|".join(re.escape(phrase) for phrase in phrases) + r")\b")
+
+
+_LIST_INTENT = _intent_pattern(LIST_INTENTS)
+_COUNT_INTENT = _intent_pattern(COUNT_INTENTS)
+
+
+# Lower-case word form used for both indexed values and questions ("Merck & Co., Inc." -> "merck & co inc")
+def _normalize(value):
+    return " ".join(_TOKEN.findall(str(value).lower().replace("_", " ")))
+
+
+# Plain and singular forms of a phrase ("antivirals" -> "antiviral", "injections" -> "injection")
+def _variants(phrase):
+    forms = {phrase}
+    if phrase.endswith("es") and len(phrase) > 4:
+        forms.add(phrase[:-2])
+    if phrase.endswith("s") and len(phrase) > 3:
+        forms.add(phrase[:-1])
+    return forms
+
+
+class StructuredDataEngine:
+    # The CSV datasets loaded once into pandas, with an inverted index (value -> row
+    # positions) on each key column. Questions that name key-column values ("which
+    # antivirals come as injections?") are answered with exact filters and counts in a
+    # few milliseconds, without embeddings or a vector search.
+
+    def __init__(self, tables, key_columns=None):
+        self.tables = tables
+        self.key_columns = key_columns or KEY_COLUMNS
+        self._indexes = {}
+        self._vocabulary = {}
+        for table, df in tables.items():
+            for column in self.key_columns.get(table, []):
+                if column not in df.columns:
+                    continue
+                codes, uniques = pd.factorize(df[column].astype(str).map(_normalize))
+                order = np.argsort(codes, kind="stable")
+                bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+                self._indexes[(table, column)] = {
+                    value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(uniques)
+                }
+                for value in uniques:
+                    # Very short values ("ya", "no") would match ordinary words
+                    if len(value) >= 3:
+                        self._vocabulary.setdefault(value, []).append((table, column))
+
+    @classmethod
+    def from_directory(cls, data_dir, key_columns=None):
+        tables = {}
+        for file_path in sorted(glob.glob(os.path.join(data_dir, "*.csv"))):
+            df = pd.read_csv(file_path, encoding="utf-8")
+            # Repeated strings are stored once per distinct value
+            for column in df.select_dtypes(include="object"):
+                if df[column].nunique() < len(df) / 2:
+                    df[column] = df[column].astype("category")
+            tables[os.path.basename(file_path)] = df
+        return cls(tables, key_columns)
+
+    # Rows of a table matching every column filter; a filter value may be a list (any of)
+    def query(self, table, filters=None, columns=None, limit=None):
+        df = self.tables[table]
+        rows = None
+        for column, values in (filters or {}).items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            index = self._indexes.get((table, column))
+            if index is not None:
+                matched = np.concatenate([index.get(_normalize(v), np.empty(0, dtype=np.int64)) for v in values])
+            else:
+                normalized = {_normalize(v) for v in values}
+                matched = np.flatnonzero(df[column].astype(str).map(_normalize).isin(normalized).to_numpy())
+            matched = np.unique(matched)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        result = df if rows is None else df.iloc[rows]
+        if columns:
+            result = result[columns]
+        return result if limit is None else result.head(limit)
+
+    # Row counts of a filtered table grouped by one column
+    def aggregate(self, table, group_by, filters=None):
+        result = self.query(table, filters)
+        return result[group_by].value_counts()
+
+    # Key-column values mentioned in the question, grouped by table: {table: {column: [values]}}
+    def match(self, question):
+        tokens = _normalize(question).split()
+        found = {}
+        for size in range(4, 0, -1):
+            for start in range(len(tokens) - size + 1):
+                for phrase in _variants(" ".join(tokens[start:start + size])):
+                    for table, column in self._vocabulary.get(phrase, []):
+                        values = found.setdefault(table, {}).setdefault(column, [])
+                        if phrase not in values:
+                            values.append(phrase)
+        return found
+
+    # Answer a structured question as text for the prompt context, or None if the question
+    # is not a lookup over the datasets or no row matches its filters
+    def lookup(self, question, limit=20):
+        text = _normalize(question)
+        counting = _COUNT_INTENT.search(text) is not None
+        if not counting and _LIST_INTENT.search(text) is None:
+            return None
+
+        matches = self.match(question)
+        if not matches:
+            return None
+        # Use the table whose values the question mentions the most
+        table, filters = max(matches.items(), key=lambda item: sum(len(v) for v in item[1].values()))
+        result = self.query(table, filters)
+        if not len(result):
+            return None
+        conditions = ", ".join(f"{column} = {' or '.join(values)}" for column, values in filters.items())
+
+        lines = [f"[{table}] {len(result)} rows where {conditions}."]
+        if counting:
+            for column in self.key_columns.get(table, []):
+                if column not in filters and column in result.columns and 1 < result[column].nunique() <= 20:
+                    counts = result[column].value_counts()
+                    lines.append(f"By {column}: " + ", ".join(f"{k}: {v}" for k, v in counts[counts > 0].items()))
+                    break
+        shown = result.head(limit)
+        lines.append(f"{'First ' + str(len(shown)) + ' rows' if len(result) > limit else 'Rows'}:")
+        lines.append(shown.to_string(index=False))
+        return "\n".join(lines)
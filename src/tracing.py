@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import itertools
+import threading
+import functools
+import contextvars
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lightweight spans around the stages of a chat turn and of ingestion. Each finished span
+# is added to a per-name latency histogram (plus totals of its integer attributes such as
+# tokens and bytes), kept in a buffer of recent spans and optionally appended to a JSON
+# lines file. Histograms are served in Prometheus text format on METRICS_PORT. With
+# TRACING off, span() returns a shared no-op object and costs one global lookup.
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+enabled = False
+_trace_file = None
+_histograms = {}
+_recent = deque(maxlen=200)
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_current = contextvars.ContextVar("span", default=None)
+_server = None
+
+
+class Histogram:
+    # Latency distribution of one span name, with totals of its integer attributes (counts
+    # of tokens, bytes, chunks...)
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.totals = {}
+
+    def observe(self, seconds, attributes):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        for key, value in attributes.items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                self.totals[key] = self.totals.get(key, 0) + value
+
+    # Estimated quantile in seconds, interpolated within the bucket it falls in
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.50) * 1000, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "totals": dict(self.totals),
+        }
+
+
+class Span:
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id", "started_at", "start", "duration", "_token")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    # Add attributes (token counts, payload sizes...) while the span is open
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _current.get()
+        self.span_id = next(_ids)
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.parent_id = parent.span_id if parent else None
+        self._token = _current.set(self)
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None and exc_type is not GeneratorExit:
+            self.attributes["error"] = exc_type.__name__
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Closed from another context (e.g. an abandoned generator)
+            pass
+        _record(self)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+# Time a block: `with span("retrieval.search") as s: ...; s.set(results=len(docs))`
+def span(name, **attributes):
+    if not enabled:
+        return _NOOP
+    return Span(name, attributes)
+
+
+# Decorator form of span() for whole functions
+def traced(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _record(finished):
+    record = {
+        "name": finished.name,
+        "trace_id": finished.trace_id,
+        "span_id": finished.span_id,
+        "parent_id": finished.parent_id,
+        "started_at": round(finished.started_at, 6),
+        "duration_ms": round(finished.duration * 1000, 3),
+        "attributes": finished.attributes,
+    }
+    with _lock:
+        histogram = _histograms.get(finished.name)
+        if histogram is None:
+            histogram = _histograms[finished.name] = Histogram()
+        histogram.observe(finished.duration, finished.attributes)
+        _recent.append(record)
+        if _trace_file is not None:
+            _trace_file.write(json.dumps(record, default=str) + "\n")
+            # A finished trace is written out as a whole
+            if finished.parent_id is None:
+                _trace_file.flush()
+
+
+# Turn tracing on or off (TRACING), and set where spans are written (TRACE_FILE)
+def configure(tracing=None, trace_file=None):
+    global enabled, _trace_file
+    if tracing is None:
+        tracing = os.environ.get("TRACING", "false").lower() in ("1", "true", "yes")
+    trace_file = trace_file or os.environ.get("TRACE_FILE")
+    with _lock:
+        enabled = tracing
+        if _trace_file is not None:
+            _trace_file.close()
+            _trace_file = None
+        if enabled and trace_file:
+            _trace_file = open(trace_file, "a", encoding="utf-8")
+
+
+def _close():
+    with _lock:
+        if _trace_file is not None:
+            _trace_file.flush()
+
+
+atexit.register(_close)
+
+
+# Histogram summaries per span name
+def snapshot():
+    with _lock:
+        return {name: histogram.snapshot() for name, histogram in sorted(_histograms.items())}
+
+
+def recent_spans():
+    with _lock:
+        return list(_recent)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _recent.clear()
+
+
+# Histograms in Prometheus text exposition format
+def prometheus_text():
+    lines = ["# TYPE chatbot_span_duration_seconds histogram"]
+    totals = []
+    with _lock:
+        for name, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.buckets):
+                cumulative += count
+                lines.append(f'chatbot_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'chatbot_span_duration_seconds_sum{{span="{name}"}} {histogram.sum:.6f}')
+            lines.append(f'chatbot_span_duration_seconds_count{{span="{name}"}} {histogram.count}')
+            totals.extend((name, key, value) for key, value in sorted(histogram.totals.items()))
+    lines.append("# TYPE chatbot_span_attribute_total counter")
+    lines.extend(f'chatbot_span_attribute_total{{span="{name}",attribute="{key}"}} {value}' for name, key, value in totals)
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = prometheus_text(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps({"histograms": snapshot(), "recent": recent_spans()}, default=str)
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics (Prometheus) and /metrics.json on localhost in a background thread, once per process
+def start_metrics_server(port=None, host="127.0.0.1"):
+    global _server
+    port = port or int(os.environ.get("METRICS_PORT", "0"))
+    with _lock:
+        if _server is None and port:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
+
+
+configure()
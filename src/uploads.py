@@ -0,0 +1,128 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import functools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from src.tracing import span
+
+
+# Number of pages in a PDF (only reads the page tree, not the page contents)
+def _page_count(file_path):
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+# Worker process: text of pages [start, end) of one PDF
+def _extract_pages(file_path, start, end):
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+class PdfExtraction:
+    # Text of one uploaded PDF, filled in page by page as the worker pool extracts it.
+    # Pages become readable in order: ready_pages is the length of the extracted prefix.
+
+    def __init__(self, digest, file_path, page_count, max_pages):
+        self.digest = digest
+        self.file_path = file_path
+        self.page_count = page_count
+        self.pages = [None] * min(page_count, max_pages)
+        self.truncated = page_count > len(self.pages)
+        self.error = None
+        self.ready_pages = 0
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    @property
+    def done(self):
+        return self.ready_pages == len(self.pages) or self.error is not None
+
+    def _fill(self, start, end, future):
+        with self._condition:
+            try:
+                texts = future.result()
+            except Exception as e:
+                self.error = f"Could not extract pages {start + 1}-{end}: {e}"
+                texts = [""] * (end - start)
+            self.pages[start:end] = texts
+            while self.ready_pages < len(self.pages) and self.pages[self.ready_pages] is not None:
+                self.ready_pages += 1
+            self._pending -= 1
+            if not self._pending:
+                shutil.rmtree(os.path.dirname(self.file_path), ignore_errors=True)
+            self._condition.notify_all()
+
+    # Block until at least `pages` pages (default: all of them) are extracted or timeout
+    # seconds have passed; returns whether they are
+    def wait(self, pages=None, timeout=None):
+        pages = len(self.pages) if pages is None else min(pages, len(self.pages))
+        with self._condition:
+            return self._condition.wait_for(lambda: self.ready_pages >= pages or self.error is not None, timeout)
+
+    # Text of the extracted pages [start, end), by default all pages extracted so far
+    def text(self, start=0, end=None):
+        end = self.ready_pages if end is None else min(end, self.ready_pages)
+        return "\n".join(self.pages[start:end])
+
+
+class UploadExtractor:
+    # Extracts the text of uploaded PDFs in a process pool, off the Streamlit script
+    # thread. The first page is extracted on its own and the rest in small page ranges, so
+    # the beginning of a document is usable while the rest is still being extracted.
+    # Results are cached by a hash of the file content, so a rerun or a re-upload of the
+    # same file is free, and uploads are capped in size and pages.
+
+    def __init__(self, max_workers=None, max_pages=None, max_bytes=None, cache_size=None, pages_per_task=None):
+        self.max_workers = max_workers or int(os.environ.get("UPLOAD_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.max_pages = max_pages or int(os.environ.get("UPLOAD_MAX_PAGES", "300"))
+        self.max_bytes = max_bytes or int(float(os.environ.get("UPLOAD_MAX_MB", "25")) * 1024 * 1024)
+        self.cache_size = cache_size or int(os.environ.get("UPLOAD_CACHE_SIZE", "32"))
+        self.pages_per_task = pages_per_task or int(os.environ.get("UPLOAD_PAGES_PER_TASK", "8"))
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._extractions = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Start (or reuse) the extraction of a PDF given as bytes; raises ValueError for files
+    # over the size limit and for files that are not readable PDFs
+    def extract(self, data):
+        if len(data) > self.max_bytes:
+            raise ValueError(f"The file is larger than the {self.max_bytes // (1024 * 1024)} MB upload limit.")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            extraction = self._extractions.get(digest)
+            if extraction is not None:
+                self._extractions.move_to_end(digest)
+                return extraction
+
+            with span("upload.start", bytes=len(data)) as s:
+                # Workers read the file from disk instead of receiving the bytes with every task
+                directory = tempfile.mkdtemp(prefix="upload-")
+                file_path = os.path.join(directory, "upload.pdf")
+                with open(file_path, "wb") as f:
+                    f.write(data)
+                try:
+                    page_count = _page_count(file_path)
+                except Exception as e:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    raise ValueError(f"The file could not be read as a PDF: {e}") from e
+                s.set(pages=page_count)
+
+            extraction = PdfExtraction(digest, file_path, page_count, self.max_pages)
+            pages = len(extraction.pages)
+            starts = [0] + list(range(1, pages, self.pages_per_task)) if pages else []
+            extraction._pending = len(starts)
+            if not starts:
+                shutil.rmtree(directory, ignore_errors=True)
+            for start in starts:
+                end = min(start + self.pages_per_task, pages) if start else 1
+                future = self._pool.submit(_extract_pages, file_path, start, end)
+                future.add_done_callback(functools.partial(extraction._fill, start, end))
+
+            self._extractions[digest] = extraction
+            while len(self._extractions) > self.cache_size:
+                self._extractions.popitem(last=False)
+            return extraction
@@ -0,0 +1,399 @@
+import os
+import json
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from src.tracing import span
+from src.dedup import mmr
+
+EMBEDDING_DIMENSION = 384
+
+
+# Connect to Pinecone, creating the index if it doesn't exist
+def _pinecone_instance(index_name):
+    from pinecone import Pinecone
+
+    pinecone_instance = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
+
+    # Check and create index if it doesn't exist
+    if index_name not in pinecone_instance.list_indexes().names():
+        pinecone_instance.create_index(
+            name=index_name,
+            dimension=EMBEDDING_DIMENSION,
+            metric='cosine'
+        )
+    return pinecone_instance
+
+
+# Pick the vector store backend from the VECTOR_STORE setting ("pinecone" or "local")
+def get_vector_store(index_name, embeddings):
+    if os.environ.get("VECTOR_STORE", "pinecone").lower() == "local":
+        return LocalVectorStore(index_name, embeddings)
+
+    from langchain_pinecone import PineconeVectorStore
+
+    _pinecone_instance(index_name)
+    return PineconeVectorStore.from_existing_index(
+        index_name=index_name,
+        embedding=embeddings
+    )
+
+
+# Return an object with Pinecone's Index upsert/delete interface for the configured backend
+def get_index(index_name, pinecone_instance=None, embeddings=None):
+    if os.environ.get("VECTOR_STORE", "pinecone").lower() == "local":
+        return LocalVectorStore(index_name, embeddings)
+    if pinecone_instance is None:
+        pinecone_instance = _pinecone_instance(index_name)
+    return pinecone_instance.Index(index_name)
+
+
+# Normalize vectors to unit length so a dot product is the cosine similarity
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Per-row symmetric int8 quantization of unit vectors: vector ~= codes * scale
+def _quantize_int8(vectors):
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+# Indices of the k largest scores, best first
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class LocalVectorStore(VectorStore):
+    # On-disk vector index: unit-length float32 vectors in an append-only memory-mapped
+    # file, one JSON line per row for the text and metadata, and a tombstone list for
+    # rows that were deleted or replaced. Search is a vectorized cosine top-k over the
+    # live rows, or over the nearest IVF clusters once build_ivf() has been run.
+    # With a compact dtype (float16 or int8) search scans a compressed copy of the vectors
+    # (half or a quarter of the memory) and rescores the best candidates with the float32
+    # rows, which are then only read from disk for those few rows.
+
+    def __init__(self, index_name, embedding, index_dir=None, dimension=EMBEDDING_DIMENSION,
+                 mode=None, nprobe=None, dtype=None, rescore=None):
+        self.index_name = index_name
+        self._embedding = embedding
+        self.dimension = dimension
+        self.index_dir = os.path.join(index_dir or os.environ.get("LOCAL_INDEX_DIR", "vector_index"), index_name)
+        self.mode = (mode or os.environ.get("LOCAL_INDEX_MODE", "flat")).lower()
+        self.nprobe = nprobe or int(os.environ.get("LOCAL_INDEX_NPROBE", "8"))
+        self.dtype = (dtype or os.environ.get("LOCAL_INDEX_DTYPE", "float32")).lower()
+        if self.dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported LOCAL_INDEX_DTYPE: {self.dtype}")
+        # Candidates per result rescored with the float32 vectors (0 keeps the compact scores)
+        self.rescore = int(os.environ.get("LOCAL_INDEX_RESCORE", "4")) if rescore is None else rescore
+        self._lock = threading.RLock()
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._vectors_path = os.path.join(self.index_dir, "vectors.f32")
+        self._docs_path = os.path.join(self.index_dir, "docs.jsonl")
+        self._tombstones_path = os.path.join(self.index_dir, "tombstones.txt")
+        self._ivf_path = os.path.join(self.index_dir, "ivf.npz")
+        self._codes_path = os.path.join(self.index_dir, "vectors.f16" if self.dtype == "float16" else "vectors.i8")
+        self._scales_path = os.path.join(self.index_dir, "scales.f32")
+        self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # (Re)load the row metadata, tombstones, vector memmap and IVF lists from disk
+    def _load(self):
+        with self._lock:
+            self._ids, self._texts, self._metadatas = [], [], []
+            if os.path.exists(self._docs_path):
+                with open(self._docs_path, encoding="utf-8") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        self._ids.append(record["id"])
+                        self._texts.append(record["text"])
+                        self._metadatas.append(record["metadata"])
+
+            self._live = np.ones(len(self._ids), dtype=bool)
+            if os.path.exists(self._tombstones_path):
+                with open(self._tombstones_path) as f:
+                    for line in f:
+                        if line.strip():
+                            self._live[int(line)] = False
+
+            self._id_to_row = {}
+            for row, doc_id in enumerate(self._ids):
+                if self._live[row]:
+                    self._id_to_row[doc_id] = row
+
+            self._map_vectors()
+            self._file_sizes = self._stat()
+
+            self._centroids, self._assignments = None, None
+            if os.path.exists(self._ivf_path):
+                ivf = np.load(self._ivf_path)
+                self._centroids = ivf["centroids"]
+                assignments = ivf["assignments"]
+                # Rows added after the IVF build are assigned to their nearest centroid
+                if len(assignments) < len(self._ids):
+                    extra = self._assign(self._vectors[len(assignments):])
+                    assignments = np.concatenate([assignments, extra])
+                self._assignments = assignments
+
+    def _map_vectors(self):
+        rows = len(self._ids)
+        if rows and os.path.getsize(self._vectors_path) >= rows * self.dimension * 4:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r",
+                                      shape=(rows, self.dimension))
+        else:
+            self._vectors = np.empty((0, self.dimension), dtype=np.float32)
+        if self.dtype != "float32":
+            self._map_codes()
+
+    # Memory-map the compact copy of the vectors, first encoding any rows it is missing
+    # (an index built before the dtype was chosen, or rows written by a float32 writer)
+    def _map_codes(self):
+        code_type = np.float16 if self.dtype == "float16" else np.int8
+        row_bytes = self.dimension * np.dtype(code_type).itemsize
+        encoded = os.path.getsize(self._codes_path) // row_bytes if os.path.exists(self._codes_path) else 0
+        if self.dtype == "int8" and os.path.exists(self._scales_path):
+            encoded = min(encoded, os.path.getsize(self._scales_path) // 4)
+        rows = len(self._vectors)
+        for start in range(encoded, rows, 65536):
+            self._append_codes(np.asarray(self._vectors[start:min(start + 65536, rows)]), encoded=start)
+        if rows:
+            self._codes = np.memmap(self._codes_path, dtype=code_type, mode="r", shape=(rows, self.dimension))
+            if self.dtype == "int8":
+                self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(rows,))
+        else:
+            self._codes = np.empty((0, self.dimension), dtype=code_type)
+            self._scales = np.empty(0, dtype=np.float32)
+
+    # Append the compact encoding of vectors, which start at row `encoded`
+    def _append_codes(self, vectors, encoded):
+        if self.dtype == "float16":
+            codes, scales = vectors.astype(np.float16), None
+        else:
+            codes, scales = _quantize_int8(vectors)
+        with open(self._codes_path, "r+b" if os.path.exists(self._codes_path) else "wb") as f:
+            f.seek(encoded * codes.shape[1] * codes.itemsize)
+            f.write(codes.tobytes())
+        if scales is not None:
+            with open(self._scales_path, "r+b" if os.path.exists(self._scales_path) else "wb") as f:
+                f.seek(encoded * 4)
+                f.write(scales.tobytes())
+
+    def __len__(self):
+        return int(self._live.sum())
+
+    # Pinecone-style upsert: vectors is a list of {'id', 'values', 'metadata'} dicts
+    def upsert(self, vectors):
+        if not vectors:
+            return {"upserted_count": 0}
+        ids = [v["id"] for v in vectors]
+        metadatas = [dict(v.get("metadata") or {}) for v in vectors]
+        texts = [m.pop("text", "") for m in metadatas]
+        self.add_embeddings(texts, [v["values"] for v in vectors], metadatas, ids)
+        return {"upserted_count": len(vectors)}
+
+    # Append pre-computed embeddings; an existing id is replaced by the new row
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [os.urandom(16).hex() for _ in texts]
+        vectors = _normalize(embeddings).reshape(len(texts), self.dimension)
+
+        with self._lock:
+            replaced = [self._id_to_row[i] for i in ids if i in self._id_to_row]
+            self._tombstone(replaced)
+
+            start = len(self._ids)
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._docs_path, "a", encoding="utf-8") as f:
+                for doc_id, text, metadata in zip(ids, texts, metadatas):
+                    f.write(json.dumps({"id": doc_id, "text": text, "metadata": metadata},
+                                       ensure_ascii=False) + "\n")
+
+            self._ids.extend(ids)
+            self._texts.extend(texts)
+            self._metadatas.extend(metadatas)
+            self._live = np.concatenate([self._live, np.ones(len(ids), dtype=bool)])
+            for row, doc_id in enumerate(ids, start):
+                self._id_to_row[doc_id] = row
+            self._map_vectors()
+            if self._centroids is not None:
+                self._assignments = np.concatenate([self._assignments, self._assign(vectors)])
+            self._file_sizes = self._stat()
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    def _tombstone(self, rows):
+        if not rows:
+            return
+        with open(self._tombstones_path, "a") as f:
+            for row in rows:
+                f.write(f"{row}\n")
+                self._live[row] = False
+                self._id_to_row.pop(self._ids[row], None)
+
+    def delete(self, ids=None, **kwargs):
+        with self._lock:
+            self._tombstone([self._id_to_row[i] for i in (ids or []) if i in self._id_to_row])
+            self._file_sizes = self._stat()
+        return True
+
+    def get_by_ids(self, ids):
+        return [self._document(self._id_to_row[i]) for i in ids if i in self._id_to_row]
+
+    def _document(self, row):
+        return Document(id=self._ids[row], page_content=self._texts[row], metadata=self._metadatas[row])
+
+    # Rewrite the files without deleted rows; rebuilds the IVF lists if present
+    def compact(self):
+        with self._lock:
+            n_lists = len(self._centroids) if self._centroids is not None else 0
+            rows = np.flatnonzero(self._live)
+            with open(self._vectors_path + ".tmp", "wb") as f:
+                for start in range(0, len(rows), 65536):
+                    f.write(np.asarray(self._vectors[rows[start:start + 65536]]).tobytes())
+            with open(self._docs_path + ".tmp", "w", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({"id": self._ids[row], "text": self._texts[row],
+                                        "metadata": self._metadatas[row]}, ensure_ascii=False) + "\n")
+            self._vectors = None
+            os.replace(self._vectors_path + ".tmp", self._vectors_path)
+            os.replace(self._docs_path + ".tmp", self._docs_path)
+            # The compact copy is re-encoded from the compacted float32 file on load
+            for path in (self._tombstones_path, self._ivf_path, self._codes_path, self._scales_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._load()
+            if n_lists:
+                self.build_ivf(n_lists)
+
+    def _assign(self, vectors):
+        if len(vectors) == 0:
+            return np.empty(0, dtype=np.int32)
+        return np.argmax(np.asarray(vectors) @ self._centroids.T, axis=1).astype(np.int32)
+
+    # Cluster the vectors with spherical k-means so search only scans the nearest lists
+    def build_ivf(self, n_lists=None, iterations=10, sample_size=50000, seed=0):
+        with self._lock:
+            rows = np.flatnonzero(self._live)
+            if len(rows) == 0:
+                return
+            n_lists = min(n_lists or int(os.environ.get("LOCAL_INDEX_NLIST", "0")) or
+                          max(1, int(np.sqrt(len(rows)))), len(rows))
+            rng = np.random.default_rng(seed)
+            sample = np.array(self._vectors[np.sort(rng.choice(rows, min(sample_size, len(rows)), replace=False))])
+            centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = sample[labels == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            self._centroids = centroids
+            self._assignments = np.concatenate([
+                self._assign(self._vectors[start:start + 65536])
+                for start in range(0, len(self._ids), 65536)
+            ])
+            np.savez(self._ivf_path, centroids=self._centroids, assignments=self._assignments)
+
+    # Pick up rows written by another process (e.g. store_index.py while the app is running)
+    def refresh(self):
+        if self._stat() != self._file_sizes:
+            self._load()
+
+    def _stat(self):
+        return tuple(os.path.getsize(path) if os.path.exists(path) else 0
+                     for path in (self._docs_path, self._tombstones_path))
+
+    # Scores of the query against some rows (a slice or an index array), computed from the
+    # compact copy of the vectors when there is one
+    def _scan(self, rows, query):
+        if self.dtype == "float32":
+            return np.asarray(self._vectors[rows]) @ query
+        scores = np.asarray(self._codes[rows], dtype=np.float32) @ query
+        return scores * self._scales[rows] if self.dtype == "int8" else scores
+
+    # Cosine scores of the query against the candidate rows: every live row, or the rows
+    # of the nprobe nearest IVF lists
+    def _score(self, query):
+        if self.mode == "ivf" and self._centroids is not None:
+            lists = _top_k(self._centroids @ query, min(self.nprobe, len(self._centroids)))
+            rows = np.flatnonzero(np.isin(self._assignments, lists) & self._live)
+            return rows, self._scan(rows, query)
+
+        # Compact rows are converted to float32 in small blocks that stay in the CPU cache
+        block = 65536 if self.dtype == "float32" else 512
+        scores = np.concatenate([
+            self._scan(slice(start, start + block), query)
+            for start in range(0, len(self._ids), block)
+        ]) if len(self._ids) else np.empty(0, dtype=np.float32)
+        rows = np.flatnonzero(self._live)
+        return rows, scores[rows]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        query = _normalize(embedding).reshape(self.dimension)
+        self.refresh()
+        with self._lock, span("vector_store.search") as s:
+            rows, scores = self._score(query)
+            s.set(candidates=len(rows))
+            if filter:
+                keep = np.array([all(self._metadatas[r].get(key) == value for key, value in filter.items())
+                                 for r in rows], dtype=bool)
+                rows, scores = rows[keep], scores[keep]
+            if self.dtype != "float32" and self.rescore:
+                # Exact scores for the best candidates of the compact scan
+                candidates = _top_k(scores, k * self.rescore)
+                rows = rows[candidates]
+                scores = np.asarray(self._vectors[rows]) @ query
+            top = _top_k(scores, k)
+            return [(self._document(int(rows[i])), float(scores[i])) for i in top]
+
+    # Maximal marginal relevance over the fetch_k most similar rows, so near-identical
+    # chunks do not take several of the k results
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None,
+                                                **kwargs):
+        with self._lock:
+            candidates = self.similarity_search_with_score_by_vector(embedding, fetch_k, filter=filter)
+            vectors = np.asarray(self._vectors[[self._id_to_row[doc.id] for doc, _ in candidates]], dtype=np.float32)
+        selected = mmr([score for _, score in candidates], lambda j: vectors @ vectors[j], k, lambda_mult)
+        return [candidates[i][0] for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(self._embedding.embed_query(query), k, fetch_k,
+                                                            lambda_mult, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, index_name="medical-chatbot", **kwargs):
+        store = cls(index_name, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -1,26 +1,36 @@
 import os
 import json
+import glob
+import threading
 from dotenv import load_dotenv
 from langchain.document_loaders import PyPDFLoader, DirectoryLoader, CSVLoader
-from langchain.embeddings import HuggingFaceBgeEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Pinecone
 from langchain.schema import Document
-from langchain.vectorstores import Pinecone
-import pinecone
+from src.vector_store import get_vector_store, get_index
+from src.embedding_cache import CachedEmbeddings
+from src.embeddings import load_embeddings, cache_name
+from src.manifest import IngestionManifest, file_hash
+from src.pipeline import IngestionPipeline
+from src.lexical import get_lexical_index
+from src.dedup import get_dedup_index
+from src import tracing
 
 load_dotenv()
 
-# Set up Pinecone configuration
+# Per-stage ingestion spans when TRACING is on, appended to TRACE_FILE
+tracing.configure()
+
+# Set up the vector store configuration (VECTOR_STORE=pinecone or local)
 api_key = os.environ.get("PINECONE_API_KEY")
 index_name = "medical-chatbot"
 environment = "us-east-1"
+manifest_path = os.environ.get("INGEST_MANIFEST", "ingest_manifest.json")
 
-pinecone.init(api_key=api_key, environment=environment)
-
-# Define the Hugging Face embeddings
-embeddings = HuggingFaceBgeEmbeddings(
-    model_name='sentence-transformers/all-MiniLM-L6-v2'
+# Define the Hugging Face embeddings (cached, so re-ingesting unchanged text is free);
+# EMBEDDING_BACKEND=onnx runs the int8-quantized ONNX version of the model instead
+embeddings = CachedEmbeddings(
+    load_embeddings('sentence-transformers/all-MiniLM-L6-v2'),
+    cache_name('sentence-transformers/all-MiniLM-L6-v2')
 )
 
 # Extract data from the PDF files
@@ -43,13 +53,116 @@ def text_split(extracted_data):
 
 # Download the embeddings from Hugging Face
 def download_hugging_face_embeddings():
-    embeddings = HuggingFaceBgeEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
-    return embeddings
-
-# Store the index in Pinecone
-def embed_store_index(chunks, embeddings, index_name):
-    index = Pinecone(
-        index_name=index_name,
-        embeddings=embeddings
+    model_name = 'sentence-transformers/all-MiniLM-L6-v2'
+    embeddings = load_embeddings(model_name)
+    return CachedEmbeddings(embeddings, cache_name(model_name))
+
+# Store the index in Pinecone or the local vector store
+def embed_store_index(chunks, embeddings, index_name, ids=None):
+    index = get_vector_store(index_name, embeddings)
+    index.add_documents(chunks, ids=ids)
+    return index
+
+# Delete vectors by ID in batches (Pinecone accepts at most 1000 IDs per request)
+def delete_from_index(index, ids, batch_size=1000):
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        index.delete(ids=ids[start:start + batch_size])
+
+# Bring the index up to date with the files under data_dirs: unchanged files are skipped
+# without being parsed, changed files only embed chunks that are not indexed yet, and
+# chunks (or whole files) that disappeared are deleted from the index. The BM25 lexical
+# index is kept in step with the vector index: a chunk is only added to it once it is in
+# the vector index, so a listed chunk missing from it (left out as a near-duplicate of a
+# chunk deleted since, or from an interrupted run) is embedded again. Unless DEDUP is off,
+# chunks that nearly duplicate another chunk are left out of both.
+def sync_index(data_dirs, embeddings, index_name, manifest_path=manifest_path):
+    manifest = IngestionManifest(manifest_path, index_name)
+    manifest_lock = threading.Lock()
+    index = get_index(index_name, embeddings=embeddings)
+    lexical = get_lexical_index(index_name)
+    dedup = get_dedup_index(index_name)
+    if os.environ.get("DEDUP", "true").lower() not in ("1", "true", "yes"):
+        # The chunks left out by earlier runs are indexed below; with the near-duplicate
+        # index emptied, a later run with DEDUP on checks the whole corpus again
+        dedup.clear()
+        dedup = None
+
+    file_paths = sorted(
+        path.replace(os.sep, "/")
+        for data in data_dirs
+        for pattern in ("*.pdf", "*.csv")
+        for path in glob.glob(os.path.join(data, pattern))
     )
-    index.add_documents(chunks)
+    orphans = set()
+
+    try:
+        for file_path in manifest.removed(file_paths):
+            delete_from_index(index, manifest.chunk_ids(file_path))
+            lexical.delete(manifest.chunk_ids(file_path))
+            if dedup is not None:
+                dedup.delete(manifest.chunk_ids(file_path))
+            manifest.forget(file_path)
+            print(f"Removed {file_path}")
+
+        # An index built before deduplication is parsed again once (without re-embedding) to
+        # find the near-duplicates it already contains
+        check_all = dedup is not None and not len(dedup) and bool(manifest.files)
+        digests = {}
+        for file_path in file_paths:
+            digest = manifest.changed(file_path)
+            if digest is not None:
+                digests[file_path] = digest
+            elif check_all or any(chunk not in lexical and (dedup is None or dedup.duplicate_of(chunk) is None)
+                                  for chunk in manifest.chunk_ids(file_path)):
+                # Holding chunks that are in neither index: parse it again, only embedding those
+                digests[file_path] = file_hash(file_path)
+        previous = {file_path: set(manifest.chunk_ids(file_path)) for file_path in digests}
+        indexed = {file_path: {chunk for chunk in previous[file_path] if chunk in lexical} for file_path in digests}
+
+        # Called by the pipeline once every new chunk of a file is in the index
+        def file_done(file_path, chunk_ids):
+            stale_ids = previous[file_path] - set(chunk_ids)
+            # Chunks indexed earlier that turned out to be near-duplicates are removed as well
+            duplicate_ids = {c for c in indexed[file_path] & set(chunk_ids) if dedup.duplicate_of(c)} if dedup else set()
+            delete_from_index(index, stale_ids | duplicate_ids)
+            lexical.delete(stale_ids | duplicate_ids)
+            with manifest_lock:
+                if dedup is not None:
+                    orphans.update(dedup.delete(stale_ids))
+                manifest.record(file_path, digests[file_path], chunk_ids)
+            dropped = {c for c in chunk_ids if dedup.duplicate_of(c)} if dedup else set()
+            new_count = len(set(chunk_ids) - indexed[file_path] - dropped)
+            print(f"Indexed {file_path}: {new_count} new, {len(stale_ids)} deleted, "
+                  f"{len(set(chunk_ids) - dropped) - new_count} unchanged chunks, {len(dropped)} near-duplicates left out")
+
+        if digests:
+            stats = IngestionPipeline(embeddings, index, lexical_index=lexical, dedup_index=dedup).run(list(digests), skip_ids=indexed, on_file_done=file_done)
+            for stage in ("parse", "embed", "upsert"):
+                print(f"{stage}: {stats[stage]['chunks']} chunks, {stats[stage]['chunks_per_second']} chunks/s")
+            if "dedup" in stats:
+                report = stats["dedup"]
+                print(f"Near-duplicates: {report['duplicates']} of {report['chunks']} chunks dropped "
+                      f"({report['index_shrink']:.1%} smaller index, ~{report['embedding_seconds_saved']}s of embedding saved, "
+                      f"{report['detection_seconds']}s to detect)")
+            print(f"Finished in {stats['seconds']}s")
+            if isinstance(embeddings, CachedEmbeddings):
+                print(f"Embedding cache: {embeddings.stats()['documents']}")
+    finally:
+        # Saved once per run (also after a failure, with the files finished so far), the
+        # indexes before the manifest that refers to them
+        if dedup is not None:
+            dedup.save()
+        lexical.save()
+        manifest.save()
+
+    # Near-duplicates of chunks deleted during this run whose files were parsed before the
+    # deletion are indexed in a second pass
+    if any(chunk not in lexical and dedup.duplicate_of(chunk) is None for chunk in orphans):
+        sync_index(data_dirs, embeddings, index_name, manifest_path)
+
+if __name__ == "__main__":
+    # The CSV datasets are queried by src/structured.py; embedding them row by row is opt-in,
+    # and leaving them out removes their vectors from an index built with them
+    data_dirs = ["Data/pdf", "Data/csv"] if os.environ.get("EMBED_CSV", "false").lower() in ("1", "true", "yes") else ["Data/pdf"]
+    sync_index(data_dirs, embeddings, index_name)
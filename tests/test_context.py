@@ -0,0 +1,22 @@
+from src.context import SessionDocumentIndex
+from src.fakes import HashEmbeddings
+
+
+def test_empty_index_can_be_extended():
+    embeddings = HashEmbeddings()
+    index = SessionDocumentIndex.from_text("", embeddings, name="scan.pdf")
+    assert index.chunks == []
+    assert index.search(embeddings.embed_query("fever")) == []
+
+    index.extend("Paracetamol lowers a fever.", embeddings)
+    index.extend("Amoxicillin is an antibiotic for bacterial infections.", embeddings)
+    assert len(index.chunks) == 2
+    assert index.vectors.shape == (2, embeddings.dimension)
+    assert index.search(embeddings.embed_query("antibiotic infections"), k=1) == [index.chunks[1]]
+
+
+def test_document_without_text_has_no_chunks():
+    embeddings = HashEmbeddings()
+    index = SessionDocumentIndex.from_text("   ", embeddings)
+    assert index.chunks == []
+    assert index.search(embeddings.embed_query("fever")) == []
@@ -0,0 +1,102 @@
+import time
+import mongomock
+from src.history import ChatHistoryWriter, load_history
+
+
+class RecordingCollection:
+    # A mongomock collection that records the size of each insert_many and can fail the
+    # first `failures` of them
+
+    def __init__(self, failures=0):
+        self.collection = mongomock.MongoClient()["medical_chatbot"]["chat_history"]
+        self.batches = []
+        self.failures = failures
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def insert_many(self, documents, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("MongoDB is unavailable")
+        self.batches.append(len(documents))
+        return self.collection.insert_many(documents, ordered=ordered)
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def save_turns(writer, count, session_id="session"):
+    for turn in range(count):
+        writer.save(session_id, f"question {turn}", f"answer {turn}", turn=turn)
+
+
+def test_turns_are_written_in_batches():
+    collection = RecordingCollection()
+    writer = ChatHistoryWriter(collection, batch_size=3, flush_interval=60)
+    save_turns(writer, 7)
+    assert wait_for(lambda: collection.batches == [3, 3])
+    writer.flush()
+    assert collection.batches == [3, 3, 1]
+    assert collection.count_documents({}) == 7
+    writer.close()
+
+
+def test_waiting_turns_are_written_after_the_flush_interval():
+    collection = RecordingCollection()
+    writer = ChatHistoryWriter(collection, batch_size=50, flush_interval=0.1)
+    save_turns(writer, 2)
+    assert wait_for(lambda: collection.count_documents({}) == 2)
+    assert collection.batches == [2]
+    writer.close()
+
+
+def test_flush_writes_everything_saved_so_far():
+    collection = RecordingCollection()
+    writer = ChatHistoryWriter(collection, batch_size=50, flush_interval=60)
+    writer.save("session", "Hi", "Hello", turn=0, metrics={"generation_time": 0.5})
+    writer.flush()
+    record = collection.find_one({"session_id": "session"}, {"_id": 0})
+    assert (record["turn"], record["user_input"], record["bot_response"]) == (0, "Hi", "Hello")
+    assert record["metrics"] == {"generation_time": 0.5}
+    writer.close()
+
+
+def test_close_writes_what_is_left():
+    collection = RecordingCollection()
+    writer = ChatHistoryWriter(collection, batch_size=50, flush_interval=60)
+    save_turns(writer, 5)
+    writer.close()
+    assert collection.count_documents({}) == 5
+    assert not writer._thread.is_alive()
+    # Flushing or closing a closed writer returns at once
+    writer.flush()
+    writer.close()
+
+
+def test_failed_writes_are_retried():
+    collection = RecordingCollection(failures=1)
+    writer = ChatHistoryWriter(collection, batch_size=50, flush_interval=60, retries=2)
+    save_turns(writer, 3)
+    writer.flush()
+    assert collection.batches == [3]
+    writer.close()
+
+
+def test_history_is_loaded_a_page_at_a_time():
+    collection = RecordingCollection()
+    writer = ChatHistoryWriter(collection, batch_size=50, flush_interval=60)
+    save_turns(writer, 5)
+    save_turns(writer, 2, session_id="other")
+    writer.close()
+
+    def turns(page):
+        return [record["turn"] for record in load_history(collection, "session", page=page, page_size=2)]
+
+    assert [turns(page) for page in range(4)] == [[3, 4], [1, 2], [0], []]
+    assert "_id" not in load_history(collection, "session")[0]
+    assert len(load_history(collection, "session")) == 5
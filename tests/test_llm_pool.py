@@ -0,0 +1,141 @@
+import time
+import threading
+from types import SimpleNamespace
+from typing import Any
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGenerationChunk
+from src.llm_pool import LLMClientPool
+
+
+class StatusError(Exception):
+    # An HTTP error of the provider, as the Groq client raises them
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+class ScriptedChatModel(BaseChatModel):
+    # Plays one outcome per call: an exception is raised, a number of seconds is slept
+    # before answering, anything else is answered at once; the last outcome repeats
+
+    outcomes: list = []
+    answer: str = "ok"
+    latency: float = 0.0
+    calls: Any = None
+
+    @property
+    def _llm_type(self):
+        return "scripted-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append(time.monotonic())
+        outcome = self.outcomes[min(len(self.calls), len(self.outcomes)) - 1] if self.outcomes else None
+        if isinstance(outcome, Exception):
+            raise outcome
+        time.sleep(outcome if isinstance(outcome, (int, float)) else self.latency)
+        for i, word in enumerate(self.answer.split()):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=(" " if i else "") + word))
+
+
+def scripted(*outcomes, **fields):
+    return ScriptedChatModel(outcomes=list(outcomes), calls=[], **fields)
+
+
+def pool(model, **settings):
+    settings = {"requests_per_minute": 60000, "burst": 100, "max_retries": 3, "backoff": 0.01,
+                "max_backoff": 0.05, "timeout": 5, **settings}
+    return LLMClientPool(model, **settings)
+
+
+MESSAGES = [HumanMessage(content="What lowers a fever?")]
+
+
+def test_rate_limits_and_server_errors_are_retried():
+    model = scripted(StatusError(429, retry_after=0.1), StatusError(503), "ok", answer="rest and fluids")
+    llm_pool = pool(model)
+    started = time.monotonic()
+    assert llm_pool.generate(MESSAGES).content == "rest and fluids"
+    assert len(model.calls) == 3
+    # The second attempt waited for the provider's Retry-After
+    assert model.calls[1] - model.calls[0] >= 0.1
+    assert time.monotonic() - started < 2
+    stats = llm_pool.stats()
+    assert (stats["attempts"], stats["retries"], stats["failures"]) == (3, 2, 0)
+
+
+def test_other_errors_are_not_retried():
+    model = scripted(StatusError(400))
+    llm_pool = pool(model)
+    with pytest.raises(StatusError):
+        llm_pool.generate(MESSAGES)
+    assert len(model.calls) == 1
+    assert llm_pool.stats()["failures"] == 1
+
+
+def test_retries_run_out():
+    model = scripted(StatusError(503))
+    llm_pool = pool(model, max_retries=2)
+    with pytest.raises(StatusError):
+        llm_pool.generate(MESSAGES)
+    assert len(model.calls) == 3
+    assert llm_pool.stats()["retries"] == 2
+
+
+def test_stalled_call_times_out_and_gives_its_slot_back():
+    # With one slot the retry can only start if the stalled call released it
+    model = scripted(2.0, "ok")
+    llm_pool = pool(model, max_concurrency=1, timeout=0.2)
+    started = time.monotonic()
+    assert llm_pool.generate(MESSAGES).content == "ok"
+    assert time.monotonic() - started < 1.5
+    assert len(model.calls) == 2
+    assert llm_pool.stats()["timeouts"] == 1
+    # The slot is not given back a second time when the stalled call ends
+    time.sleep(2.0)
+    assert llm_pool._slots.acquire(blocking=False)
+    assert not llm_pool._slots.acquire(blocking=False)
+    llm_pool._slots.release()
+
+
+def test_fallback_model_answers_when_the_primary_fails():
+    primary, fallback = scripted(StatusError(503)), scripted(answer="fallback")
+    llm_pool = pool(primary, fallback=fallback, max_retries=1)
+    assert llm_pool.generate(MESSAGES).content == "fallback"
+    assert (len(primary.calls), len(fallback.calls)) == (2, 1)
+    stats = llm_pool.stats()
+    assert (stats["fallbacks"], stats["failures"]) == (1, 0)
+
+
+def test_identical_requests_in_flight_share_one_call():
+    model = scripted(latency=0.3, answer="one answer")
+    llm_pool = pool(model)
+    answers = []
+    threads = [threading.Thread(target=lambda: answers.append(llm_pool.generate(MESSAGES).content))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert answers == ["one answer"] * 4
+    assert len(model.calls) == 1
+    assert llm_pool.stats()["coalesced"] == 3
+
+
+def test_coalescing_can_be_turned_off():
+    model = scripted(latency=0.2)
+    llm_pool = pool(model, coalesce=False)
+    threads = [threading.Thread(target=llm_pool.generate, args=(MESSAGES,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(model.calls) == 2
+    assert llm_pool.stats()["coalesced"] == 0